@@ -0,0 +1,588 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018 Sebastian Garcia, eldracote
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# Offline benchmarks of twitter_profiler.
+# Synthetic tweets and users are generated at the scales asked, and the download functions
+# are run against a fake twitter API inside this process, and against a local HTTP server that stands in for twitter. No network is needed.
+#
+# Usage:
+# python benchmark.py -o results.json
+# python benchmark.py -t 100,100000 -f 1000,1000000 -s 2,500 --latency 0.05 --ratelimit 180 --window 2
+
+from __future__ import unicode_literals
+import BaseHTTPServer
+import SocketServer
+import argparse
+import codecs
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urlparse
+import numpy
+import tweepy
+from tweepy.models import Status, User as TwitterUser
+import twitter_profiler
+
+
+LANGS = ['en', 'es', 'fr', 'de', 'cs', 'ru', 'und']
+SOURCES = ['Twitter Web Client', 'Twitter for Android', 'Twitter for iPhone', 'TweetDeck', 'IFTTT']
+TIMEZONES = ['Madrid', 'Prague', 'Pacific Time (US & Canada)', 'UTC', None]
+DOMAINS = ['twitter.com', 'example.com', 'news.example.org', 'blog.example.net', 'youtube.com']
+# Modules that the commands that only read the cache index should not import
+HEAVY_MODULES = ('tweepy', 'requests', 'numpy', 'pydot', 'tqdm', 'ascii_graph', 'secrets')
+HASHTAGS = ['news', 'python', 'security', 'music', 'sports', 'politics', 'tech']
+
+
+def user_json(user_id, rng):
+    """ The json of a synthetic twitter user """
+    return {
+        'id': user_id, 'id_str': str(user_id), 'screen_name': 'user{}'.format(user_id), 'name': 'User {}'.format(user_id),
+        'lang': rng.choice(LANGS), 'time_zone': rng.choice(TIMEZONES), 'utc_offset': rng.choice([None, 3600, 7200, -18000]),
+        'location': 'Somewhere', 'created_at': 'Mon Jan 01 10:00:00 +0000 2018', 'followers_count': rng.randint(0, 10000),
+        'friends_count': rng.randint(0, 5000), 'statuses_count': rng.randint(0, 50000), 'listed_count': rng.randint(0, 100),
+        'favourites_count': rng.randint(0, 1000), 'protected': False, 'verified': False, 'geo_enabled': True,
+        'default_profile_image': False, 'url': None, 'description': 'A synthetic user',
+    }
+
+
+def lookup_ids(user_ids, screen_names):
+    """ The ids of the users asked to users/lookup by id or by screen name. The synthetic users are named user<id>, other names are not found """
+    ids = [int(user_id) for user_id in user_ids or []]
+    ids.extend(int(name[len('user'):]) for name in screen_names or [] if name.lower().startswith('user') and name[len('user'):].isdigit())
+    return ids
+
+
+def status_json(status_id, author, rng):
+    """ The json of a synthetic tweet of the author """
+    created_at = datetime.datetime(2018, 1, 1) + datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+    entities = {
+        'hashtags': [{'text': rng.choice(HASHTAGS)} for _ in range(rng.randint(0, 2))],
+        'urls': [{'expanded_url': 'https://{}/{}'.format(rng.choice(DOMAINS), rng.randint(0, 1000))} for _ in range(rng.randint(0, 1))],
+        'user_mentions': [{'screen_name': 'user{}'.format(rng.randint(0, 500))} for _ in range(rng.randint(0, 2))],
+    }
+    status = {
+        'id': status_id, 'id_str': str(status_id), 'created_at': created_at.strftime('%a %b %d %H:%M:%S +0000 %Y'),
+        'full_text': 'Synthetic tweet {}'.format(status_id), 'text': 'Synthetic tweet {}'.format(status_id),
+        'lang': rng.choice(LANGS), 'source': rng.choice(SOURCES), 'source_url': 'https://twitter.com',
+        'entities': entities, 'user': author, 'place': None,
+    }
+    if rng.random() < 0.05:
+        status['place'] = {'id': 'p', 'name': rng.choice(['Prague', 'Madrid', 'Buenos Aires']), 'full_name': 'Place', 'country': 'Country', 'bounding_box': None}
+    if rng.random() < 0.3:
+        retweeted = user_json(rng.randint(1, 500), rng)
+        status['retweeted_status'] = {'id': status_id + 10 ** 12, 'id_str': str(status_id + 10 ** 12), 'created_at': status['created_at'],
+                                      'full_text': 'Retweeted', 'entities': {'hashtags': [], 'urls': [], 'user_mentions': []}, 'user': retweeted}
+    return status
+
+
+def synthetic_statuses(amount, rng, api):
+    """ A list of tweepy Status of one author, from the newest to the oldest """
+    author = user_json(1, rng)
+    return [Status.parse(api, status_json(status_id, author, rng)) for status_id in range(amount, 0, -1)]
+
+
+def synthetic_profiles(amount, rng, first_id=1000):
+    """ A dict of Profile records by screen name """
+    profiles = {}
+    for user_id in xrange(first_id, first_id + amount):
+        profile = twitter_profiler.Profile(id=user_id, screen_name='user{}'.format(user_id), lang=rng.choice(LANGS), time_zone=rng.choice(TIMEZONES))
+        profiles[profile.screen_name] = profile
+    return profiles
+
+
+class FakeResponse(object):
+    """ The part of a requests response that the rate limit scheduler reads """
+    def __init__(self, remaining, reset, status_code=200):
+        self.headers = {'x-rate-limit-remaining': str(remaining), 'x-rate-limit-reset': str(reset)}
+        self.status_code = status_code
+
+
+class FakeTwitterAPI(object):
+    """
+    A fake tweepy.API for one seed user, with a configurable latency per call and rate limit per endpoint.
+    The rate limit windows are of `window` seconds, with `rate_limit` calls each. 0 means no limit.
+    """
+    def __init__(self, friends, followers, tweets, latency=0.0, rate_limit=0, window=1.0, seed=0):
+        self.parser_api = tweepy.API()
+        self.rng = random.Random(seed)
+        self.friends = friends
+        self.followers = followers
+        self.tweets = tweets
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.window = window
+        self.calls = {}
+        self.used = {}
+        self.resets = {}
+        self.last_response = None
+        self.author = user_json(1, self.rng)
+        self.author.update({'friends_count': friends, 'followers_count': followers, 'statuses_count': tweets})
+
+    def _call(self, endpoint):
+        """ Count the call, wait the latency and apply the rate limit """
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        time.sleep(self.latency)
+        now = time.time()
+        if self.resets.get(endpoint, 0) <= now:
+            self.resets[endpoint] = now + self.window
+            self.used[endpoint] = 0
+        self.used[endpoint] += 1
+        if self.rate_limit and self.used[endpoint] > self.rate_limit:
+            self.last_response = FakeResponse(0, int(self.resets[endpoint]) + 1, 429)
+            raise tweepy.error.RateLimitError([{'code': 88, 'message': 'Rate limit exceeded'}], self.last_response)
+        remaining = self.rate_limit - self.used[endpoint] if self.rate_limit else 10 ** 6
+        self.last_response = FakeResponse(remaining, int(self.resets[endpoint]) + 1)
+
+    def get_user(self, *args, **kwargs):
+        self._call('users/show')
+        return TwitterUser.parse(self.parser_api, self.author)
+
+    def lookup_users(self, user_ids=None, screen_names=None, include_entities=None):
+        self._call('users/lookup')
+        ids = lookup_ids(user_ids, screen_names)
+        if not ids:
+            raise tweepy.error.TweepError([{'code': 17, 'message': 'No user matches for specified terms.'}])
+        return [TwitterUser.parse(self.parser_api, user_json(user_id, self.rng)) for user_id in ids]
+
+    def _ids_page(self, endpoint, first_id, amount, cursor):
+        """ Pages of 5000 ids. The cursor is the position of the next page """
+        self._call(endpoint)
+        start = 0 if cursor in (None, -1) else cursor
+        end = min(start + 5000, amount)
+        next_cursor = end if end < amount else 0
+        return range(first_id + start, first_id + end), (0, next_cursor)
+
+    def friends_ids(self, screen_name=None, cursor=None, **kwargs):
+        return self._ids_page('friends/ids', 10 ** 6, self.friends, cursor)
+
+    def followers_ids(self, screen_name=None, cursor=None, **kwargs):
+        return self._ids_page('followers/ids', 2 * 10 ** 6, self.followers, cursor)
+
+    def user_timeline(self, screen_name=None, count=20, since_id=None, max_id=None, **kwargs):
+        self._call('statuses/user_timeline')
+        newest = min(self.tweets, max_id or self.tweets)
+        oldest = max(since_id or 0, self.tweets - 3200, newest - count)
+        return [Status.parse(self.parser_api, status_json(status_id, self.author, self.rng)) for status_id in range(newest, oldest, -1)]
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Answers the calls to the stand-in server. HTTP/1.1 keeps the connections open between calls """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.respond(urlparse.parse_qs(urlparse.urlparse(self.path).query))
+
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        self.respond(urlparse.parse_qs(self.rfile.read(length)))
+
+    def respond(self, query):
+        parameters = {key: values[-1] for key, values in query.items()}
+        status, headers, body = self.server.twitter.answer(urlparse.urlparse(self.path).path, parameters)
+        data = json.dumps(body)
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class StandInTwitter(object):
+    """
+    A local HTTP server that stands in for the twitter REST API, for the TwitterClient of twitter_profiler.
+    It answers users/show, statuses/user_timeline, friends/ids, followers/ids and users/lookup for one seed user like FakeTwitterAPI,
+    with the same latency, rate limits and headers. Each connection is answered in its own thread.
+    """
+    def __init__(self, friends, followers, tweets, latency=0.0, rate_limit=0, window=1.0, seed=0):
+        self.friends = friends
+        self.followers = followers
+        self.tweets = tweets
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.window = window
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.used = {}
+        self.resets = {}
+        self.author = user_json(1, random.Random(seed))
+        self.author.update({'friends_count': friends, 'followers_count': followers, 'statuses_count': tweets})
+        self.server = StandInServer(('127.0.0.1', 0), StandInHandler)
+        self.server.twitter = self
+        self.url = 'http://127.0.0.1:{}/1.1/'.format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def answer(self, path, parameters):
+        """ The status, headers and json of the answer to a call """
+        endpoint = path[len('/1.1/'):-len('.json')]
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            now = time.time()
+            if self.resets.get(endpoint, 0) <= now:
+                self.resets[endpoint] = now + self.window
+                self.used[endpoint] = 0
+            self.used[endpoint] += 1
+            used = self.used[endpoint]
+            reset = int(self.resets[endpoint]) + 1
+            rng = random.Random(self.seed * 1000003 + sum(self.calls.values()))
+        if self.rate_limit and used > self.rate_limit:
+            return 429, {'x-rate-limit-remaining': '0', 'x-rate-limit-reset': str(reset)}, {'errors': [{'code': 88, 'message': 'Rate limit exceeded'}]}
+        headers = {'x-rate-limit-remaining': str(self.rate_limit - used if self.rate_limit else 10 ** 6), 'x-rate-limit-reset': str(reset)}
+        if endpoint == 'users/show':
+            return 200, headers, self.author
+        if endpoint == 'statuses/user_timeline':
+            count = int(parameters.get('count', 20))
+            newest = min(self.tweets, int(parameters.get('max_id', self.tweets)))
+            oldest = max(int(parameters.get('since_id', 0)), self.tweets - 3200, newest - count)
+            return 200, headers, [status_json(status_id, self.author, rng) for status_id in range(newest, oldest, -1)]
+        if endpoint in ('friends/ids', 'followers/ids'):
+            first_id, amount = (10 ** 6, self.friends) if endpoint == 'friends/ids' else (2 * 10 ** 6, self.followers)
+            cursor = int(parameters.get('cursor', -1))
+            start = 0 if cursor == -1 else cursor
+            end = min(start + 5000, amount)
+            return 200, headers, {'ids': range(first_id + start, first_id + end), 'previous_cursor': 0, 'next_cursor': end if end < amount else 0}
+        if endpoint == 'users/lookup':
+            ids = lookup_ids([user_id for user_id in parameters.get('user_id', '').split(',') if user_id], parameters.get('screen_name', '').split(','))
+            if not ids:
+                return 404, headers, {'errors': [{'code': 17, 'message': 'No user matches for specified terms.'}]}
+            return 200, headers, [user_json(user_id, rng) for user_id in ids]
+        return 404, headers, {'errors': [{'code': 34, 'message': 'Sorry, that page does not exist'}]}
+
+
+class Benchmark(object):
+    """ Runs the benchmarks and collects the results """
+    def __init__(self, options):
+        self.options = options
+        self.results = []
+        # Any benchmark that raises an error or gets other amounts than expected makes the run fail
+        self.failed = False
+        self.rng = random.Random(options.seed)
+        self.parser_api = tweepy.API()
+        self.cachepath = tempfile.mkdtemp(prefix='twitter_profiler_benchmark_')
+        twitter_profiler.args = twitter_profiler.parse_arguments(['--rebuildstats'])
+        twitter_profiler.args.nosummary = True
+        self.use_cache(self.cachepath + '/')
+
+    def use_cache(self, path):
+        """ Point twitter_profiler to an empty cache """
+        twitter_profiler.dirpath = path
+        twitter_profiler.manifest = None
+        twitter_profiler.profile_store = None
+
+    def new_user(self, name):
+        """ A new user with its folder in the cache """
+        os.makedirs(twitter_profiler.dirpath + name)
+        user = twitter_profiler.User(name)
+        info = user_json(1, self.rng)
+        info.update({'lang': 'en', 'time_zone': 'UTC', 'utc_offset': 0})
+        user.user_info = TwitterUser.parse(self.parser_api, info)
+        user.label = {'label_what': 1.0, 'label_how': ['benchmark']}
+        return user
+
+    def timed(self, name, params, function, *args):
+        """ Time the best of `repeat` runs of the function, with its output hidden """
+        times = []
+        error = None
+        for _ in range(self.options.repeat):
+            stdout, stderr = sys.stdout, sys.stderr
+            sys.stdout = sys.stderr = codecs.getwriter('utf-8')(open(os.devnull, 'w'))
+            start = time.time()
+            try:
+                function(*args)
+            except Exception as e:
+                error = '{}: {}'.format(type(e).__name__, e)
+            finally:
+                times.append(time.time() - start)
+                sys.stdout.close()
+                sys.stdout, sys.stderr = stdout, stderr
+        result = {'name': name, 'params': params, 'seconds': min(times)}
+        if error:
+            result['error'] = error
+            self.failed = True
+        self.results.append(result)
+        print('{:28} {:45} {:10.4f} s {}'.format(name, json.dumps(params, sort_keys=True), min(times), error or ''))
+        return result
+
+    def check(self, what, expected, actual):
+        """ Fail the last benchmark if an amount is not the expected one """
+        if expected == actual:
+            return
+        result = self.results[-1]
+        error = '{} is {}, expected {}'.format(what, actual, expected)
+        result['error'] = '{}, {}'.format(result['error'], error) if 'error' in result else error
+        self.failed = True
+        print('{:28} {}'.format(result['name'], error))
+
+    def timed_downloads(self, prefix, params):
+        """
+        Time the download of a new user and the monitor of fetchusers names from the fake API or the stand-in server in use,
+        and check that all the friends, followers and tweets were cached and all the names that exist were monitored
+        """
+        options = self.options
+        user = self.new_user(prefix or 'fetch')
+        self.timed(prefix + 'get_twitter_info', params, user.get_twitter_info)
+        self.timed(prefix + 'get_friends', params, user.get_friends)
+        self.check('friends cached', options.fetchusers, user.cached_count('friends'))
+        self.timed(prefix + 'get_followers', params, user.get_followers)
+        self.check('followers cached', options.fetchusers, user.cached_count('followers'))
+        self.timed(prefix + 'get_tweets', params, user.get_tweets)
+        # Twitter only gives the last 3,200 tweets
+        self.check('tweets cached', min(options.fetchtweets, 3200), user.cached_count('tweets'))
+        # The monitor asks for the users by screen name. One name in each hundred does not exist
+        names = ['user{}'.format(user_id) if user_id % 100 else 'missing{}'.format(user_id) for user_id in range(1, options.fetchusers + 1)]
+        self.timed(prefix + 'monitor_users', params, twitter_profiler.monitor_users, names, None)
+        path = twitter_profiler.dirpath + twitter_profiler.TIMESERIES_DIR
+        monitored = len([name for name in os.listdir(path) if name.endswith('.ts')]) if os.path.isdir(path) else 0
+        self.check('users monitored', len([name for name in names if name.startswith('user')]), monitored)
+        return user
+
+    def bench_tweets(self, amount):
+        """ process_tweets, and print_summary with that amount of tweets """
+        user = self.new_user('tweets{}'.format(amount))
+        for status in synthetic_statuses(amount, self.rng, self.parser_api):
+            user.tweets[status.id] = status
+        twitter_profiler.args.rebuildstats = True
+        self.timed('process_tweets', {'tweets': amount}, user.process_tweets)
+        twitter_profiler.args.rebuildstats = False
+        self.timed('process_tweets_incremental', {'tweets': amount}, user.process_tweets)
+        self.timed('print_tweets_info', {'tweets': amount}, user.print_tweets_info)
+
+    def bench_neighbours(self, amount):
+        """ process_friends, process_followers and print_summary with that amount of followers """
+        user = self.new_user('neighbours{}'.format(amount))
+        user.friends = synthetic_profiles(amount, self.rng)
+        user.followers = synthetic_profiles(amount, self.rng, first_id=10 ** 7)
+        self.timed('process_friends', {'friends': amount}, user.process_friends)
+        self.timed('process_followers', {'followers': amount}, user.process_followers)
+        user.analyze_features()
+        self.timed('print_summary', {'followers': amount, 'friends': amount}, user.print_summary)
+
+    def bench_cache(self, tweets, followers):
+        """ Store and load a user from the cache """
+        name = 'cache{}_{}'.format(tweets, followers)
+        user = self.new_user(name)
+        for status in synthetic_statuses(tweets, self.rng, self.parser_api):
+            user.tweets[status.id] = status
+        user.friends = synthetic_profiles(followers, self.rng)
+        user.followers = synthetic_profiles(followers, self.rng, first_id=10 ** 7)
+        params = {'tweets': tweets, 'followers': followers, 'friends': followers}
+        self.timed('cache_store_full', params, twitter_profiler.store_user, user)
+        # Add 1% of new tweets and store again
+        new_statuses = synthetic_statuses(tweets + max(tweets // 100, 1), self.rng, self.parser_api)[:max(tweets // 100, 1)]
+        for status in new_statuses:
+            user.tweets[status.id] = status
+        self.timed('cache_store_incremental', dict(params, new_tweets=len(new_statuses)), twitter_profiler.store_user, user)
+        def load():
+            loaded = twitter_profiler.load_user(name)
+            return len(loaded.tweets) + len(loaded.friends) + len(loaded.followers)
+        self.timed('cache_load', params, load)
+        self.timed('cache_load_profile_only', params, twitter_profiler.load_user, name)
+
+    def bench_graph(self, seeds):
+        """ plot_users over that amount of seed users that share part of their friends """
+        names = []
+        pool = max(seeds * 200, 1000)
+        for seed in range(seeds):
+            name = 'seed{}_{}'.format(seeds, seed)
+            user = self.new_user(name)
+            # Popular accounts are followed by more seeds
+            friend_ids = set(int(pool * self.rng.random() ** 3) for _ in range(self.options.seedfriends))
+            user.friends = {'user{}'.format(friend_id): twitter_profiler.Profile(id=friend_id, screen_name='user{}'.format(friend_id)) for friend_id in friend_ids}
+            twitter_profiler.store_user(user)
+            names.append(name)
+        workdir = tempfile.mkdtemp(prefix='twitter_profiler_graph_')
+        current = os.getcwd()
+        os.chdir(workdir)
+        try:
+            self.timed('plot_users', {'seeds': seeds, 'friends_per_seed': self.options.seedfriends}, twitter_profiler.plot_users, ','.join(names), twitter_profiler.dirpath)
+        finally:
+            os.chdir(current)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def bench_fetch(self):
+        """ get_twitter_info, get_friends, get_followers, get_tweets and monitor_users against the fake API """
+        options = self.options
+        fake_api = FakeTwitterAPI(options.fetchusers, options.fetchusers, options.fetchtweets, latency=options.latency, rate_limit=options.ratelimit, window=options.window, seed=options.seed)
+        twitter_profiler.twitter_api = fake_api
+        twitter_profiler.rate_limiter = twitter_profiler.RateLimiter()
+        twitter_profiler.args.numfriends = options.fetchusers
+        twitter_profiler.args.numfollowers = options.fetchusers
+        twitter_profiler.args.maxtweets = options.fetchtweets
+        params = {'users': options.fetchusers, 'tweets': options.fetchtweets, 'latency': options.latency, 'rate_limit': options.ratelimit, 'window': options.window}
+        self.timed_downloads('', params)
+        self.results[-1]['api_calls'] = fake_api.calls
+        self.results[-1]['rate_limit_waits'] = dict(twitter_profiler.rate_limiter.waited)
+
+    def bench_http(self, connections):
+        """ get_twitter_info, get_friends, get_followers, get_tweets and monitor_users with the HTTP client of twitter_profiler and that many connections, against a local stand-in server """
+        options = self.options
+        server = StandInTwitter(options.fetchusers, options.fetchusers, options.fetchtweets, latency=options.httplatency, rate_limit=options.ratelimit, window=options.window, seed=options.seed)
+        try:
+            # An empty cache, so the profiles are not taken from the profile store
+            self.use_cache(self.cachepath + '/http{}/'.format(connections))
+            twitter_profiler.twitter_api = twitter_profiler.TwitterClient(base_url=server.url, connections=connections)
+            twitter_profiler.rate_limiter = twitter_profiler.RateLimiter()
+            twitter_profiler.args.connections = connections
+            twitter_profiler.args.numfriends = options.fetchusers
+            twitter_profiler.args.numfollowers = options.fetchusers
+            twitter_profiler.args.maxtweets = options.fetchtweets
+            params = {'users': options.fetchusers, 'tweets': options.fetchtweets, 'latency': options.httplatency, 'rate_limit': options.ratelimit, 'window': options.window, 'connections': connections}
+            user = self.timed_downloads('http_', params)
+            self.results[-1]['api_calls'] = dict(server.calls)
+            self.results[-1]['rate_limit_waits'] = dict(twitter_profiler.rate_limiter.waited)
+            self.results[-1]['followers_cached'] = user.cached_count('followers')
+        finally:
+            twitter_profiler.args.connections = 1
+            server.close()
+
+    def bench_startup(self):
+        """
+        Cold start of twitter_profiler -i in a new interpreter, which only reads the cache index.
+        Fails if it takes more than the budget or if the heavy modules are loaded when -i exits.
+        """
+        options = self.options
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'twitter_profiler.py')
+        home = tempfile.mkdtemp(prefix='twitter_profiler_home_')
+        os.makedirs(os.path.join(home, '.twitter_analyzer_users'))
+        environment = dict(os.environ, HOME=home)
+        devnull = open(os.devnull, 'w')
+        def best_time(command):
+            times = []
+            for _ in range(options.startupruns):
+                start = time.time()
+                subprocess.check_call(command, env=environment, stdout=devnull, stderr=devnull)
+                times.append(time.time() - start)
+            return min(times)
+        try:
+            interpreter = best_time([sys.executable, '-c', 'pass'])
+            startup = best_time([sys.executable, script, '-i'])
+            # Run the real -i, exit included, and look at the modules loaded at the end of it. The last line of the output is the list
+            probe = ('import runpy, sys\n'
+                     'sys.argv = [{script!r}, "-i"]\n'
+                     'try:\n'
+                     '    runpy.run_path({script!r}, run_name="__main__")\n'
+                     'except SystemExit:\n'
+                     '    pass\n'
+                     'print("\\n" + ",".join(m for m in {modules!r} if m in sys.modules))\n').format(script=script, modules=HEAVY_MODULES)
+            imported = subprocess.check_output([sys.executable, '-c', probe], env=environment, cwd=os.path.dirname(script), stderr=devnull).splitlines()[-1].strip()
+        finally:
+            shutil.rmtree(home, ignore_errors=True)
+        result = {'name': 'startup_list_cache', 'params': {'budget': options.startupbudget, 'runs': options.startupruns}, 'seconds': startup,
+                  'interpreter_seconds': interpreter, 'heavy_modules_imported': imported.split(',') if imported else []}
+        errors = []
+        if startup > options.startupbudget:
+            errors.append('over the budget of {} s'.format(options.startupbudget))
+        if imported:
+            errors.append('imports {}'.format(imported))
+        if errors:
+            result['error'] = ', '.join(errors)
+            self.failed = True
+        self.results.append(result)
+        print('{:28} {:45} {:10.4f} s {}'.format(result['name'], json.dumps(result['params'], sort_keys=True), startup, result.get('error', '')))
+
+    def run(self):
+        options = self.options
+        try:
+            if options.startupruns:
+                self.bench_startup()
+            for amount in options.tweets:
+                self.bench_tweets(amount)
+            for amount in options.followers:
+                self.bench_neighbours(amount)
+            for tweets, followers in zip(options.tweets, options.followers):
+                self.bench_cache(tweets, followers)
+            for seeds in options.seeds:
+                self.bench_graph(seeds)
+            if options.fetchusers:
+                self.bench_fetch()
+                for connections in options.connections:
+                    self.bench_http(connections)
+        finally:
+            shutil.rmtree(self.cachepath, ignore_errors=True)
+        return self.results
+
+
+def git_commit():
+    """ The commit being measured, to compare results between commits """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def int_list(text):
+    return [int(value) for value in text.split(',') if value]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks of twitter_profiler with synthetic data and a fake twitter API.')
+    parser.add_argument('-t', '--tweets', type=int_list, default=[100, 1000, 10000], help='Comma separated amounts of tweets per user. Default 100,1000,10000')
+    parser.add_argument('-f', '--followers', type=int_list, default=[1000, 10000, 100000], help='Comma separated amounts of friends and followers per user. Default 1000,10000,100000')
+    parser.add_argument('-s', '--seeds', type=int_list, default=[2, 10, 50], help='Comma separated amounts of seed users for plot_users. Default 2,10,50')
+    parser.add_argument('--seedfriends', type=int, default=500, help='Friends of each seed user for plot_users. Default 500')
+    parser.add_argument('--fetchusers', type=int, default=2000, help='Friends and followers to download from the fake API. 0 to skip the download benchmarks. Default 2000')
+    parser.add_argument('--fetchtweets', type=int, default=1000, help='Tweets to download from the fake API. Default 1000')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds that each call to the fake API takes. Default 0')
+    parser.add_argument('--ratelimit', type=int, default=0, help='Calls allowed per endpoint in each rate limit window of the fake API. 0 for no limit. Default 0')
+    parser.add_argument('--window', type=float, default=1.0, help='Seconds of each rate limit window of the fake API. Default 1')
+    parser.add_argument('--connections', type=int_list, default=[1, 8], help='Comma separated amounts of connections of the HTTP client, for the downloads from the local stand-in server. Empty to skip them. Default 1,8')
+    parser.add_argument('--httplatency', type=float, default=0.02, help='Seconds that each call to the local stand-in server takes. Default 0.02')
+    parser.add_argument('--startupruns', type=int, default=5, help='Runs of the cold start check of twitter_profiler -i. The best time is compared with the budget. 0 to skip it. Default 5')
+    parser.add_argument('--startupbudget', type=float, default=0.5, help='Maximum seconds for the cold start of twitter_profiler -i. If it takes more, or the heavy modules are imported, the benchmark exits with an error. Default 0.5')
+    parser.add_argument('-r', '--repeat', type=int, default=1, help='Runs of each benchmark. The best time is reported. Default 1')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator, to compare runs with the same data. Default 0')
+    parser.add_argument('-o', '--output', help='File to write the results as json. Default is to print them.')
+    options = parser.parse_args()
+
+    benchmark = Benchmark(options)
+    results = {
+        'commit': git_commit(),
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'options': vars(options),
+        'results': benchmark.run(),
+    }
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+        print('Results written to {}'.format(options.output))
+    else:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    if benchmark.failed:
+        print('Failed: ' + '; '.join('{} {}'.format(result['name'], result['error']) for result in benchmark.results if 'error' in result))
+        sys.exit(1)
@@ -31,31 +31,107 @@
 # python twitter_profiler.py -n screen_name
 
 from __future__ import unicode_literals
-from ascii_graph import Pyasciigraph
-from ascii_graph.colors import Gre, Yel, Red
-from ascii_graph.colordata import hcolor
 from collections import OrderedDict
-from tqdm import tqdm
-import tweepy
-import numpy
+import importlib
 import argparse
 import collections
 import datetime
+import calendar
+import contextlib
 import time
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import sys
 import copy
 import os
 from urlparse import urlparse
-from secrets import consumer_key, consumer_secret, access_token, access_token_secret, repustate_client
-import pydot 
-import pickle
+import cPickle as pickle
+import sqlite3
+from cStringIO import StringIO
 import shutil
+import subprocess
+import io
 import json
 from os import listdir
 from os.path import isdir, join
+from xml.sax.saxutils import quoteattr
+
+class LazyModule(object):
+    """
+    A module that is imported the first time one of its attributes is used.
+    tweepy and numpy take most of the start time, and the commands that only read the cache index do not need them.
+    tqdm, ascii_graph and the secrets are imported where they are used.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+tweepy = LazyModule('tweepy')
+numpy = LazyModule('numpy')
 
 
 __version__ = '0.5.3'
+# Maximum amount of ids that twitter accepts in one users/lookup call
+LOOKUP_BATCH_SIZE = 100
+# Attributes of a User that are stored one row per object in the disk store and only loaded when used
+LAZY_ATTRIBUTES = ('tweets', 'friends', 'followers')
+# Lists of ids of a User that are stored apart as arrays and only loaded when used
+ID_ATTRIBUTES = ('friends_ids', 'followers_ids')
+# Length in seconds of the twitter rate limit windows, and how many times we wait for a rate limit before giving up on a call
+RATE_LIMIT_WINDOW = 900
+RATE_LIMIT_RETRIES = 3
+# Root of the twitter REST API, and seconds to wait for an answer, for our own HTTP client (--connections, --apiurl)
+API_URL = 'https://api.twitter.com/1.1/'
+HTTP_TIMEOUT = 60
+# Attributes of a User with the results of its analysis. They are what the worker processes of the offline analysis send back
+SUMMARY_ATTRIBUTES = ('protected', 'label', 'FFR', 'retweets', 'geo_enabled_tweets', 'tweets_detected_langs', 'tweets_detected_sources', 'tweets_detected_places',
+                      'tweets_detected_hashtags', 'tweets_detected_domains', 'tweets_detected_timezones', 'tweets_mentioned_users', 'retweeted_users',
+                      'activity_hourly', 'activity_weekly', 'friends_lang', 'friends_timezone', 'followers_lang', 'followers_timezone', 'last_refresh')
+# Maximum amount of tweets that twitter gives in one page of a timeline
+TIMELINE_PAGE_SIZE = 200
+# Fields of the twitter profile kept for each friend and follower
+PROFILE_FIELDS = ('id', 'screen_name', 'name', 'lang', 'time_zone', 'utc_offset', 'location', 'created_at', 'followers_count', 'friends_count', 'statuses_count', 'listed_count', 'favourites_count', 'protected', 'verified', 'geo_enabled', 'default_profile_image', 'url')
+# Amount of ids of friends or followers in each record of the JSON Lines export. The same as a page of twitter
+EXPORT_IDS_PAGE_SIZE = 5000
+# Tweets in each call to the sentiment analysis, and calls at the same time
+SENTIMENT_BATCH_SIZE = 100
+SENTIMENT_WORKERS = 4
+# Name of the index of the users, in the root of the cache
+MANIFEST_NAME = 'manifest.db'
+# Counters of the analysis of the tweets kept for each user in the index of the cache, by the name used with --query
+QUERY_COUNTERS = OrderedDict([('hashtags', 'tweets_detected_hashtags'), ('domains', 'tweets_detected_domains'), ('retweeted', 'retweeted_users'),
+                              ('mentions', 'tweets_mentioned_users'), ('langs', 'tweets_detected_langs'), ('sources', 'tweets_detected_sources')])
+# Name of the store of the profiles of all the friends and followers, in the root of the cache
+PROFILES_NAME = 'profiles.db'
+# Maximum amount of variables in one sqlite query
+SQLITE_MAX_VARIABLES = 900
+# Folder of the time series of the monitored users, in the root of the cache. Screen names can not have a dot
+TIMESERIES_DIR = '.timeseries'
+# Record of each refresh of a monitored user. The time series file of a user is a sequence of these records, oldest first
+TIMESERIES_FIELDS = [(str('time'), str('<i8')), (str('followers_count'), str('<i8')), (str('friends_count'), str('<i8')), (str('statuses_count'), str('<i8')), (str('listed_count'), str('<i8'))]
+# Hash functions of the MinHash sketches used to compare users when scipy is not installed, and ids hashed at once
+MINHASH_PERMUTATIONS = 128
+MINHASH_CHUNK_SIZE = 10000
+# Colors of the nodes in the graph of users, by the amount of users that share the node, from 1 to 10
+SHARED_COLORS = ('LightBlue', 'Red', 'Yellow', 'Blue', 'Orange', 'crimson', 'forestgreen', 'deeppink', 'cadetblue', 'aquamarine')
+# RGB of those colors, and of the white and black nodes, for the formats that do not know the names of the Graphviz colors
+GEXF_COLORS = {'LightBlue': (173, 216, 230), 'Red': (255, 0, 0), 'Yellow': (255, 255, 0), 'Blue': (0, 0, 255), 'Orange': (255, 165, 0), 'crimson': (220, 20, 60), 'forestgreen': (34, 139, 34), 'deeppink': (255, 20, 147), 'cadetblue': (95, 158, 160), 'aquamarine': (127, 255, 212), 'white': (255, 255, 255), 'black': (0, 0, 0)}
+# Index of the users in the cache, opened the first time it is used
+manifest = None
+manifest_lock = threading.Lock()
+# Client of the sentiment analysis. By default the repustate client of the secrets. Can be replaced by any object with the same methods
+sentiment_client = None
+# Profiles of the friends and followers of all the users, opened the first time it is used
+profile_store = None
+profile_store_lock = threading.Lock()
+# Connections to the databases of the cache inherited by a worker process from its parent. Kept so they are not closed from the worker
+inherited_connections = None
 # The features dict is global because we dont want to store it in the user since all of its values are already there. Is only to put them together
 features = {}
 
@@ -77,6 +153,25 @@ def set_output_encoding(encoding='utf-8'):
     if current is None :
         sys.stderr = codecs.getwriter(encoding)(sys.stderr)
 
+def id_position(ids, wanted):
+    """
+    Position of an id in an array of ids. Like list.index(), raises ValueError if it is not there
+    """
+    positions = numpy.flatnonzero(ids == wanted)
+    if not len(positions):
+        raise ValueError(wanted)
+    return positions[0]
+
+def count_values(values):
+    """
+    Count the values of a categorical column by giving each different value an integer code and counting the codes with numpy.
+    Returns a Counter
+    """
+    codes = {}
+    encoded = numpy.fromiter((codes.setdefault(value, len(codes)) for value in values), dtype=numpy.int64)
+    amounts = numpy.bincount(encoded, minlength=len(codes))
+    return collections.Counter({value: int(amounts[code]) for value, code in codes.iteritems()})
+
 class User():
     """ 
     A class to manage all the data of a twitter user
@@ -100,21 +195,90 @@ class User():
         self.id_screen_names = {}
         self.friends_timezone = collections.Counter()
         self.friends_lang = collections.Counter()
-        self.friends_ids = {}
+        self.friends_ids = numpy.array([], dtype=numpy.int64)
         self.friends = {}
-        self.followers_ids = {}
+        self.followers_ids = numpy.array([], dtype=numpy.int64)
         self.last_follower_retrieved_id = False
+        self.last_follower_retrieved_position = None
         self.followers = {}
         self.dirpath = ''
         self.last_friend_retrieved_id = False
+        self.last_friend_retrieved_position = None
         self.user_info = False
         # If the user is protected
         self.protected = False
         self.activity_hourly = { ("%2i:00" % i).replace(" ", "0"): 0 for i in range(24) }
         self.activity_weekly = { "%i" % i: 0 for i in range(7) }
+        # When we last downloaded the user from twitter
+        self.last_refresh = None
+        # Range of tweet ids already added to the statistics, and the utc offset used for them
+        self.first_processed_tweet_id = None
+        self.last_processed_tweet_id = None
+        self.statistics_utc_offset = None
+        # Ranges of tweets (since_id, max_id) not downloaded yet between tweets of the cache, newest first
+        self.tweet_gaps = []
+        # Ids of the tweets that filled gaps, inside the range of processed tweets but not added to the statistics yet
+        self.gap_tweet_ids = []
         # Label of the user
         self.label = ""
 
+    def __getattr__(self, attribute):
+        """
+        Load the tweets, friends, followers and their ids from the disk store only the first time they are used
+        """
+        store = self.__dict__.get('_store')
+        if attribute in LAZY_ATTRIBUTES and store is not None:
+            with run_stats.phase('cache_load'):
+                value = store.load_objects(attribute)
+            self.__dict__[attribute] = value
+            return value
+        if attribute in ID_ATTRIBUTES and store is not None:
+            with run_stats.phase('cache_load'):
+                value = store.load_ids(attribute)
+            self.__dict__[attribute] = value
+            return value
+        raise AttributeError(attribute)
+
+    def __getstate__(self):
+        """
+        Never pickle the connection to the disk store
+        """
+        state = self.__dict__.copy()
+        state.pop('_store', None)
+        return state
+
+    def cached_count(self, attribute):
+        """
+        Amount of tweets, friends or followers in the cache, without loading them if they were not used yet
+        """
+        if attribute in self.__dict__:
+            return len(self.__dict__[attribute])
+        store = self.__dict__.get('_store')
+        if store is not None:
+            return store.count(attribute)
+        return self.__dict__.get('cached_counts', {}).get(attribute, 0)
+
+    def summary(self):
+        """
+        The results of the analysis of this user, without its tweets, friends and followers.
+        Small enough to send from a worker process, and print_summary(process=False) prints them.
+        """
+        summary = {attribute: self.__dict__[attribute] for attribute in SUMMARY_ATTRIBUTES if attribute in self.__dict__}
+        summary['user_info'] = Profile.from_twitter(self.user_info) if self.user_info else self.user_info
+        summary['cached_counts'] = {attribute: self.cached_count(attribute) for attribute in LAZY_ATTRIBUTES}
+        return summary
+
+    @classmethod
+    def from_summary(cls, screen_name, summary):
+        """
+        A user with only the results of its analysis. It has no tweets, friends or followers
+        """
+        user = cls(screen_name)
+        for attribute in LAZY_ATTRIBUTES + ID_ATTRIBUTES:
+            del user.__dict__[attribute]
+        user.__dict__.update(summary)
+        return user
+
     def analyze_features(self):
         """
         Computes the features for this profile
@@ -125,37 +289,51 @@ class User():
 
     def analyze_sentiments(self):
         """
-        For each twitt, analyze the sentiment
+        Analyze the sentiment of all the tweets.
+        The scores are stored by tweet id, so each tweet is scored only once. The language is the one twitter gives for the tweet.
+        The tweets are sent in batches of the same language, to the bulk interface of the client if it has one, several batches at the same time.
         """
-        # 'add_filter', 'add_sentiment_rule', 'api_key', 'bulk_sentiment', 'categorize', 'chunk', 
-        # 'clean_html', 'commit_sentiment_rules', 'delete_filter', 'delete_sentiment_rule', 
-        # 'detect_language', 'entities', 'filter', 'function', 'host', 'list_filters', 
-        # 'list_sentiment_rules', 'port', 'pos_tags', 'protocol', 'sentiment', 'topic_sentiment', 
-        # 'url_template', 'usage', 'version']
         if args.color:
             def bold(text):
                 return '\033[1m' + text + '\033[0m'
         else:
             def bold(text):
                 return text
-        print('[+] Sentiment Analysis of Tweets')
-        counter = 50
-        for twitt in self.tweets:
-            if counter <= 0:
-                break
-            text = self.tweets[twitt].text.replace('\n',' ')
+        store = get_store(self)
+        scores = store.load_sentiments()
+        pending = [tweet for tweet_id, tweet in self.tweets.iteritems() if tweet_id not in scores]
+        print('[+] Sentiment Analysis of Tweets. {} tweets already scored, {} to score.'.format(len(self.tweets) - len(pending), len(pending)))
+        if pending:
+            # Batches of tweets of the same language
+            by_language = OrderedDict()
+            for tweet in pending:
+                language = getattr(tweet, 'lang', None)
+                if language in (None, 'und'):
+                    language = None
+                by_language.setdefault(language, []).append(tweet)
+            batches = [(language, tweets[position:position + SENTIMENT_BATCH_SIZE]) for language, tweets in by_language.iteritems() for position in range(0, len(tweets), SENTIMENT_BATCH_SIZE)]
+            client = get_sentiment_client()
+            pool = ThreadPool(min(SENTIMENT_WORKERS, len(batches)))
             try:
-                language = repustate_client.detect_language(text.encode('utf-8'))['language']
-                print('Sentiment: \033[1m{:16}\033[0m. Text: {}'.format(repustate_client.sentiment(text.encode('utf-8'), lang=language)['score'], text))
-            except UnicodeEncodeError:
-                print('\tEncode error with: {}'.format(text))
-	    except Exception as inst:
-		print 'Problem in analyze_sentiments () in class Processor'
-		print type(inst)     # the exception instance
-		print inst.args      # arguments stored in .args
-		print inst           # __str__ allows args to printed directly
-                print 'Text: {}'.format(text)
-            counter -= 1
+                with progress_bar(total=len(pending), unit='tw') as pbar:
+                    for batch_scores in pool.imap_unordered(lambda batch: score_sentiments(client, batch[0], batch[1]), batches):
+                        # Store each batch as soon as it is scored
+                        store.add_sentiments(batch_scores)
+                        scores.update(batch_scores)
+                        pbar.update(len(batch_scores))
+            finally:
+                pool.close()
+        scored = [(scores[tweet_id], tweet) for tweet_id, tweet in self.tweets.iteritems() if tweet_id in scores]
+        if not scored:
+            return
+        scored.sort(key=lambda score_tweet: score_tweet[0])
+        print('[+] Average sentiment: {} ({} tweets)'.format(bold('{:.3f}'.format(numpy.mean([score for score, tweet in scored]))), len(scored)))
+        print('[+] Most positive tweets')
+        for score, tweet in reversed(scored[-5:]):
+            print('Sentiment: \033[1m{:16}\033[0m. Text: {}'.format(score, tweet_text(tweet).replace('\n', ' ')))
+        print('[+] Most negative tweets')
+        for score, tweet in scored[:5]:
+            print('Sentiment: \033[1m{:16}\033[0m. Text: {}'.format(score, tweet_text(tweet).replace('\n', ' ')))
 
     def set_twitter_info(self, data):
         """ Sets the data of this user by hand.
@@ -170,16 +348,18 @@ class User():
         Since we store the complete Twitter object inside our object, we don't need to extract each value independently. We just use them.
         """
         try:
-            self.user_info = twitter_api.get_user(self.screen_name)
+            self.user_info = rate_limiter.call('users/show', 'get_user', self.screen_name)
             if args.debug > 2:
                 print 'Twitter user aquired from API.'
             # If the user is protected, mark it now. We do this here so from now on the object can deal with this situation correctly
             self.protected = self.user_info.protected
+            self.last_refresh = datetime.datetime.now()
             return True
         except tweepy.error.TweepError as e:
             if e[0][0]['code'] == 50: # 50 is user not found
                 print('User not found!')
-                shutil.rmtree(dirpath + name, ignore_errors=True)
+                shutil.rmtree(dirpath + self.screen_name, ignore_errors=True)
+                get_manifest().remove(self.screen_name)
                 return False
             elif e[0][0]['code'] == 63: # your account is suspended
                 print('User has been suspended')
@@ -193,42 +373,102 @@ class User():
                 print e
                 return False
 
+    def timeline_pages(self, since_id=None, max_id=None):
+        """
+        Download the timeline of the user page by page, from the newest tweets to the oldest.
+        Only tweets newer than since_id and not newer than max_id are asked. Each next page is asked with max_id below the oldest tweet received.
+        This method can only return up to 3,200 of a user's most recent Tweets
+        """
+        while True:
+            page = rate_limiter.call('statuses/user_timeline', 'user_timeline', screen_name=self.screen_name, count=TIMELINE_PAGE_SIZE, since_id=since_id, max_id=max_id, tweet_mode='extended')
+            if not page:
+                return
+            yield page
+            max_id = page[-1].id - 1
+
+    def download_tweets(self, num_tweets, since_id=None, max_id=None):
+        """
+        Download up to num_tweets tweets of the timeline newer than since_id and not newer than max_id.
+        The tweets are added to the cache keeping it sorted from the newest to the oldest, even if the download is interrupted.
+        With since_id, the tweets that were not downloaded down to it are remembered as a gap in tweet_gaps, to fill it in the next runs.
+        """
+        downloaded = []
+        complete = False
+        try:
+            with progress_bar(total=num_tweets, unit="tw") as pbar:
+                for page in self.timeline_pages(since_id, max_id):
+                    page = page[:num_tweets - len(downloaded)]
+                    downloaded.extend(page)
+                    pbar.update(len(page))
+                    if len(downloaded) >= num_tweets:
+                        break
+                else:
+                    complete = True
+        finally:
+            if since_id:
+                # This range is done, or what is left of it is a gap. Without max_id and nothing downloaded there is no gap, the next run asks since the same tweet
+                gaps = [gap for gap in getattr(self, 'tweet_gaps', []) if gap != (since_id, max_id)]
+                if not complete and (downloaded or max_id is not None):
+                    gaps.append((since_id, downloaded[-1].id - 1 if downloaded else max_id))
+                # A gap filled exactly is left empty, with nothing newer than since_id and not newer than max_id
+                self.tweet_gaps = sorted((gap for gap in gaps if gap[1] > gap[0]), reverse=True)
+            if downloaded and since_id and max_id:
+                # The tweets of a gap go between the ones we had. They are inside the range already processed, so they are remembered to add them to the statistics
+                self.gap_tweet_ids = getattr(self, 'gap_tweet_ids', []) + [status.id for status in downloaded]
+                tweets = dict(self.tweets)
+                for status in downloaded:
+                    tweets.setdefault(status.id, status)
+                self.tweets = OrderedDict((id, tweets[id]) for id in sorted(tweets, reverse=True))
+            elif downloaded and since_id:
+                # Newer tweets go before the ones we had
+                tweets = OrderedDict((status.id, status) for status in downloaded)
+                for id in self.tweets:
+                    tweets.setdefault(id, self.tweets[id])
+                self.tweets = tweets
+            else:
+                # Older tweets go after the ones we had
+                for status in downloaded:
+                    self.tweets.setdefault(status.id, status)
+        return len(downloaded)
+
     def get_tweets(self):
-        """ Download Tweets from username account """
-        tweets_still_to_retrieve = self.user_info.statuses_count - len(self.tweets)
-        num_tweets = numpy.amin([args.maxtweets, tweets_still_to_retrieve])
+        """
+        Download Tweets from username account.
+        By default only the tweets newer than the newest in the cache are downloaded, and then the gaps left by earlier runs that stopped at --maxtweets.
+        With --backfill, the tweets older than the oldest in the cache.
+        """
         if args.offline or args.maxtweets <= 0:
             # Don't download, so we will use the tweets already in the cache
             return True
         else:
             # Download tweets
             try:
-                if tweets_still_to_retrieve == 0:
-                    # If the number of tweets to retrieve is zero, get out...
-                    return True
-                if len(self.tweets) < self.user_info.statuses_count:
-                    print('[+] Tweets to Download. In cache: {}. Tweets in the account: {}. Downloading next {} tweets...'.format(len(self.tweets), self.user_info.statuses_count, num_tweets))
-                    try:
-                        # We do have a last tweet downloaded, continue from there...
-                        last_tweet_obtained = self.tweets.keys()[-1]
+                if args.backfill:
+                    if self.tweets:
+                        max_id = min(self.tweets) - 1
+                    else:
+                        max_id = None
+                    print('[+] Tweets to Download. In cache: {}. Tweets in the account: {}. Downloading up to {} tweets older than the cache...'.format(len(self.tweets), self.user_info.statuses_count, args.maxtweets))
+                    amount = self.download_tweets(args.maxtweets, max_id=max_id)
+                    if args.debug > 0:
+                        print('Downloaded {} older tweets.'.format(amount))
+                elif len(self.tweets) < self.user_info.statuses_count:
+                    if self.tweets:
+                        since_id = max(self.tweets)
                         if args.debug > 2:
-                            print('The last downloaded twit was: {}'.format(last_tweet_obtained))
-                        # This method can only return up to 3,200 of a user’s most recent Tweets
-                        for status in tqdm(tweepy.Cursor(twitter_api.user_timeline, screen_name=self.screen_name, tweet_mode = 'extended').items(num_tweets), unit="tw", total=num_tweets):
-                            # Create a new twitt
-                            if not self.tweets.has_key(status.id):
-                                #print 'NEW: {}'.format(status.id)
-                                self.tweets[status.id] = status
-                            else:
-                                #print 'We had this tweet: {}'.format(status.id)
-                                pass
-                    except IndexError:
-                        # No previous tweets downloaded, start fresh.
-                        for status in tqdm(tweepy.Cursor(twitter_api.user_timeline, screen_name=self.screen_name).items(num_tweets), unit="tw", total=num_tweets):
-                            # Create a new twit
-                            self.tweets[status.id] = status
-                    except:
-                        print 'Unexpected error while retriving tweets in get_tweets()'
+                            print('The newest downloaded twit was: {}'.format(since_id))
+                    else:
+                        since_id = None
+                    print('[+] Tweets to Download. In cache: {}. Tweets in the account: {}. Downloading up to {} new tweets...'.format(len(self.tweets), self.user_info.statuses_count, args.maxtweets))
+                    amount = self.download_tweets(args.maxtweets, since_id=since_id)
+                    if args.debug > 0:
+                        print('Downloaded {} new tweets.'.format(amount))
+                    # With what is left of --maxtweets, fill the gaps between the tweets of the cache, the newest first
+                    for gap_since_id, gap_max_id in list(getattr(self, 'tweet_gaps', [])):
+                        if amount >= args.maxtweets:
+                            break
+                        print('[+] Downloading up to {} tweets missing between tweets {} and {}...'.format(args.maxtweets - amount, gap_since_id, gap_max_id))
+                        amount += self.download_tweets(args.maxtweets - amount, since_id=gap_since_id, max_id=gap_max_id)
                 else:
                     # The number of previous tweets and current tweets is the same, do not download them
                     if args.debug > 1:
@@ -255,24 +495,26 @@ class User():
                         print('Not Authorized for some reason')
                         return False
 
-    def print_summary(self):
+    def print_summary(self, process=True):
         """
-        Print a summary of the account
+        Print a summary of the account.
+        With process False, the tweets, friends and followers were already analyzed and are not used
         """
         # Print basic info
         self.print_basic_info()
         # Print info about the tweets
-        self.print_tweets()
+        self.print_tweets(process)
         # Print info about the friends
-        self.print_friends_analysis()
+        self.print_friends_analysis(process)
         # Print info about the followers
-        try:
-            _temp = self.followers
-        except AttributeError:
-            self.followers = {}
-            self.followers_ids = {}
-            self.last_follower_retrieved_id = False
-        self.print_followers_analysis()
+        if process:
+            try:
+                _temp = self.followers
+            except AttributeError:
+                self.followers = {}
+                self.followers_ids = numpy.array([], dtype=numpy.int64)
+                self.last_follower_retrieved_id = False
+        self.print_followers_analysis(process)
 
     def add_label(self, label):
         """
@@ -324,12 +566,12 @@ class User():
             temp_dict[self.screen_name]['features'] = features
             try:
                 temp_dict[self.screen_name]['followers'] = self.followers.keys()
-                temp_dict[self.screen_name]['followers_ids'] = self.followers_ids
+                temp_dict[self.screen_name]['followers_ids'] = list(self.followers_ids)
             except AttributeError:
                 pass
             try:
                 temp_dict[self.screen_name]['friends'] = self.friends.keys()
-                temp_dict[self.screen_name]['friends_ids'] = self.friends_ids
+                temp_dict[self.screen_name]['friends_ids'] = list(self.friends_ids)
             except AttributeError:
                 pass
             temp_dict[self.screen_name]['label'] = self.label
@@ -337,19 +579,61 @@ class User():
             with open(dirpath + self.screen_name + '/' + self.screen_name + '-data.json', 'wb') as file:
                 file.write(user_json)
 
-    def print_tweets(self):
+    def export_jsonl(self, output):
+        """
+        Write the user to the output as JSON Lines. One record for the profile, one for each tweet, friend and follower,
+        and the ids of the friends and followers in pages of EXPORT_IDS_PAGE_SIZE. Every record has its 'type' and 'user'.
+        The tweets, friends and followers that were not loaded are read one by one from the cache, so the memory does not grow with the user.
+        """
+        write_jsonl(output, {'type': 'profile', 'user': self.screen_name, 'profile': getattr(self.user_info, '_json', None), 'label': self.label or None, 'last_refresh': self.last_refresh})
+        for table, kind in (('tweets', 'tweet'), ('friends', 'friend'), ('followers', 'follower')):
+            if table in self.__dict__:
+                objects = self.__dict__[table].iteritems()
+            elif '_store' in self.__dict__:
+                objects = self._store.iter_objects(table)
+            else:
+                objects = []
+            for key, value in objects:
+                if kind == 'tweet':
+                    write_jsonl(output, {'type': kind, 'user': self.screen_name, 'tweet': value._json})
+                else:
+                    write_jsonl(output, {'type': kind, 'user': self.screen_name, 'profile': {field: getattr(value, field) for field in PROFILE_FIELDS}})
+        for attribute in ID_ATTRIBUTES:
+            ids = getattr(self, attribute)
+            for position in xrange(0, len(ids), EXPORT_IDS_PAGE_SIZE):
+                write_jsonl(output, {'type': attribute, 'user': self.screen_name, 'ids': ids[position:position + EXPORT_IDS_PAGE_SIZE].tolist()})
+
+    def print_tweets(self, process=True):
         """ Get the tweets and print them"""
         # Get the tweets first
-        if self.tweets:
-            # Analyze the tweets
-            self.process_tweets()
+        if self.cached_count('tweets'):
+            # Analyze the tweets, if it was not done already
+            if process:
+                self.process_tweets()
             # Print them
             self.print_tweets_info()
 
     def process_tweets(self):
-        """ Processing a single Tweet and updating our datasets """
+        """ Processing all the Tweets and updating our datasets """
         # text=u'Get th' # is_quote_status=False, # in_reply_to_status_id=None, # id=963923415663919104, # favorite_count=2, # '_json', # 'author', # 'contributors', # 'coordinates', # 'created_at', # 'destroy', # 'entities', # 'favorite', # 'favorite_count', # 'favorited', # 'geo', # 'id', # 'id_str', # 'in_reply_to_screen_name', # 'in_reply_to_status_id', # 'in_reply_to_status_id_str', # 'in_reply_to_user_id', # 'in_reply_to_user_id_str', # 'is_quote_status', # 'lang', # 'parse', # 'parse_list', # 'place', # 'possibly_sensitive', # 'retweet', # 'retweet_count', # 'retweeted', # 'retweets', # 'source', # 'source_url', # 'text', # 'truncated', # 'user' # source_url=u'http://twitter.com', 
-        # Every time we process, we should reset the counters
+        # The statistics are stored with the user. Only the tweets outside the range of ids already processed are added, and the ones that filled gaps inside it,
+        # unless we are asked to rebuild them or the utc offset used changed
+        first_processed = getattr(self, 'first_processed_tweet_id', None)
+        last_processed = getattr(self, 'last_processed_tweet_id', None)
+        gap_ids = set(getattr(self, 'gap_tweet_ids', []))
+        self.gap_tweet_ids = []
+        if not args.rebuildstats and last_processed is not None and getattr(self, 'statistics_utc_offset', None) == args.utc_offset:
+            store = self.__dict__.get('_store')
+            if 'tweets' not in self.__dict__ and store is not None:
+                # The tweets were not used yet. Read only the new ones from the store
+                new_tweets = store.load_tweets_outside(first_processed, last_processed, gap_ids)
+            else:
+                new_tweets = [self.tweets[id] for id in self.tweets if id > last_processed or id < first_processed or id in gap_ids]
+            if args.debug > 1:
+                print('Adding {} new tweets to the statistics.'.format(len(new_tweets)))
+            self.add_tweets_statistics(new_tweets)
+            return
+        # Rebuilding, we should reset the counters
         self.tweets_detected_langs = collections.Counter()
         self.tweets_detected_sources = collections.Counter()
         self.tweets_detected_places = collections.Counter()
@@ -362,81 +646,74 @@ class User():
         self.retweets = 0
         self.activity_hourly = { ("%2i:00" % i).replace(" ", "0"): 0 for i in range(24) }
         self.activity_weekly = { "%i" % i: 0 for i in range(7) }
-        for id in self.tweets:
-            tweet = self.tweets[id]
-            tw_date = tweet.created_at
-            # Handling retweets
-            # How many times the tweet was retweeted?
-            # print(tweet.retweet_count)
-            # How many times the tweet was favorited?
-            # tweet.favorite_count
-            # Was this tweet retweeted by others?
-            # print(tweet.retweeted)
-            # Do something with quoted tweets
-            # print(tweet.is_quote_status)
-            # Is this a reply tweet?
-            # in_reply_to_status_id
-            # Compute the amount of retweets of this user
-            try:
-                rtstatus = tweet.retweeted_status
-                # Its a retweet
-                self.retweets += 1
-                rt_id_user = tweet.retweeted_status.user.id_str
-                rt_name_user = tweet.retweeted_status.user.screen_name
-                self.retweeted_users[rt_name_user] += 1
-            except AttributeError:
-                # Its a normal tweet
-                pass
-            # Adding timezone from profile offset to set to local hours
-            if tweet.user.utc_offset:
-                tw_date = (tweet.created_at + datetime.timedelta(seconds=tweet.user.utc_offset))
-            if args.utc_offset:
-                tw_date = (tweet.created_at + datetime.timedelta(seconds=args.utc_offset))
-            # Updating our activity datasets (distribution maps)
-            self.activity_hourly["{}:00".format(str(tw_date.hour).zfill(2))] += 1
-            self.activity_weekly[str(tw_date.weekday())] += 1
-            # Updating langs
-            try:
-                self.tweets_detected_langs[tweet.lang] += 1
-            except KeyError:
-                self.tweets_detected_langs[tweet.lang] = 1
-            # Updating sources
-            try:
-                self.tweets_detected_sources[tweet.source] += 1
-            except KeyError:
-                self.tweets_detected_sources[tweet.source] = 1
-            # Detecting geolocation
-            if tweet.place:
-                self.geo_enabled_tweets += 1
-                try:
-                    self.tweets_detected_places[tweet.place.name] += 1
-                except KeyError:
-                    self.tweets_detected_places[tweet.place.name] = 1
-            # Updating hashtags list
-            if tweet.entities['hashtags']:
-                for ht in tweet.entities['hashtags']:
-                    #ht['text'] = "#{}".format(ht['text'])
-                    try:
-                        self.tweets_detected_hashtags[ht['text']] += 1
-                    except KeyError:
-                        self.tweets_detected_hashtags[ht['text']] = 1
-            # Updating domains list
-            if tweet.entities['urls']:
-                for url in tweet.entities['urls']:
-                    domain = urlparse(url['expanded_url']).netloc
-                    if domain != "twitter.com":  # removing twitter.com from domains (not very relevant)
-                        try:
-                            self.tweets_detected_domains[domain] += 1
-                        except KeyError:
-                            self.tweets_detected_domains[domain] = 1
-            # Updating mentioned users list
-            # The problem is that we should do this with IDs, not with screen names. But it was too dificult.
-            if tweet.entities['user_mentions']:
-                for ht in tweet.entities['user_mentions']:
-                    try:
-                        self.tweets_mentioned_users[ht['screen_name']] += 1
-                    except KeyError:
-                        self.tweets_mentioned_users[ht['screen_name']] = 1
+        self.first_processed_tweet_id = None
+        self.last_processed_tweet_id = None
+        self.statistics_utc_offset = args.utc_offset
+        self.add_tweets_statistics(self.tweets.values())
+
+    def add_tweets_statistics(self, tweets):
+        """
+        Add a list of tweets to the statistics of this user.
+        The values are extracted once in columns, the activity is computed with numpy and the rest is counted by integer codes.
+        """
+        # Handling retweets
+        # How many times the tweet was retweeted?
+        # print(tweet.retweet_count)
+        # How many times the tweet was favorited?
+        # tweet.favorite_count
+        # Was this tweet retweeted by others?
+        # print(tweet.retweeted)
+        # Do something with quoted tweets
+        # print(tweet.is_quote_status)
+        # Is this a reply tweet?
+        # in_reply_to_status_id
+        if not tweets:
+            return
+        # Remember the range of ids already in the statistics
+        ids = [tweet.id for tweet in tweets]
+        if self.last_processed_tweet_id is None:
+            self.first_processed_tweet_id = min(ids)
+            self.last_processed_tweet_id = max(ids)
+        else:
+            self.first_processed_tweet_id = min(self.first_processed_tweet_id, min(ids))
+            self.last_processed_tweet_id = max(self.last_processed_tweet_id, max(ids))
+        # Compute the amount of retweets of this user
+        retweeted_names = [tweet.retweeted_status.user.screen_name for tweet in tweets if hasattr(tweet, 'retweeted_status')]
+        self.retweets += len(retweeted_names)
+        self.retweeted_users.update(count_values(retweeted_names))
+        # Adding timezone from profile offset to set to local hours
+        timestamps = numpy.fromiter((calendar.timegm(tweet.created_at.utctimetuple()) for tweet in tweets), dtype=numpy.int64, count=len(tweets))
+        if args.utc_offset:
+            offsets = args.utc_offset
+        else:
+            offsets = numpy.fromiter((tweet.user.utc_offset or 0 for tweet in tweets), dtype=numpy.int64, count=len(tweets))
+        local_times = timestamps + offsets
+        # Updating our activity datasets (distribution maps). The epoch was a thursday, weekday 3
+        hours = numpy.bincount((local_times // 3600) % 24, minlength=24)
+        weekdays = numpy.bincount((local_times // 86400 + 3) % 7, minlength=7)
+        for hour in range(24):
+            self.activity_hourly["{}:00".format(str(hour).zfill(2))] += int(hours[hour])
+        for weekday in range(7):
+            self.activity_weekly[str(weekday)] += int(weekdays[weekday])
+        # Updating langs
+        self.tweets_detected_langs.update(count_values(tweet.lang for tweet in tweets))
+        # Updating sources
+        self.tweets_detected_sources.update(count_values(tweet.source for tweet in tweets))
+        # Detecting geolocation
+        places = [tweet.place.name for tweet in tweets if tweet.place]
+        self.geo_enabled_tweets += len(places)
+        self.tweets_detected_places.update(count_values(places))
+        # Updating hashtags list
+        self.tweets_detected_hashtags.update(count_values(ht['text'] for tweet in tweets for ht in tweet.entities['hashtags']))
+        # Updating domains list. Each different url is parsed only once
+        urls = count_values(url['expanded_url'] for tweet in tweets for url in tweet.entities['urls'])
+        for url, amount in urls.iteritems():
+            domain = urlparse(url).netloc
+            if domain != "twitter.com":  # removing twitter.com from domains (not very relevant)
+                self.tweets_detected_domains[domain] += amount
+        # Updating mentioned users list
+        # The problem is that we should do this with IDs, not with screen names. But it was too dificult.
+        self.tweets_mentioned_users.update(count_values(ht['screen_name'] for tweet in tweets for ht in tweet.entities['user_mentions']))
 
     def print_tweets_info(self):
         """ Output the tweets"""
@@ -491,18 +768,18 @@ class User():
         except AttributeError:
             pass
         try:
-            print('[+] Followers cache: {}'.format(bold(str(len(self.followers)))))
+            print('[+] Followers cache: {}'.format(bold(str(self.cached_count('followers')))))
         except AttributeError:
             pass
         print('[+] Friends        : {}'.format(bold(str(self.user_info.friends_count))))
-        print('[+] Friends cache  : {}'.format(bold(str(len(self.friends)))))
+        print('[+] Friends cache  : {}'.format(bold(str(self.cached_count('friends')))))
         print('[+] MemberPubLists : {}'.format(bold(str(self.user_info.listed_count))))
         print('[+] Location       : {}'.format(bold(self.user_info.location)))
         print('[+] Name           : {}'.format(bold(self.user_info.name)))
         print('[+] Protected      : {}'.format(bold(str(self.user_info.protected))))
         print('[+] Screen Name    : {}'.format(bold(self.screen_name)))
         print('[+] # Tweets       : {}'.format(bold(str(self.user_info.statuses_count))))
-        print('[+] # Tweets cache : {}'.format(bold(str(len(self.tweets)))))
+        print('[+] # Tweets cache : {}'.format(bold(str(self.cached_count('tweets')))))
         print('[+] # ReTweets cache : {}'.format(bold(self.retweets)))
         print('[+] URL            : {}'.format(bold(str(self.user_info.url))))
         print('[+] Verified?      : {}'.format(bold(str(self.user_info.verified))))
@@ -521,14 +798,15 @@ class User():
         """
         print('{},{},{}'.format(datetime.datetime.now(), self.screen_name, self.user_info.followers_count))
 
-    def print_friends_analysis(self):
+    def print_friends_analysis(self, process=True):
         """
         Analyze the friends of this user
         """
         # If the account is protected, we can not ask for its friends
         if not self.protected:
-            print('[+] Analyzing {} friends.'.format(len(self.friends)))
-            self.process_friends()
+            print('[+] Analyzing {} friends.'.format(self.cached_count('friends')))
+            if process:
+                self.process_friends()
             self.print_stats(self.friends_lang, "[+] Top Friends languages.", top=10)
             self.print_stats(self.friends_timezone, "[+] Top Friends timezones.", top=10)
 
@@ -538,10 +816,10 @@ class User():
         self.friends_lang = collections.Counter()
         for friend in self.friends:
             try:
-                if self.friends[friend].user_info.lang:
-                    self.friends_lang[self.friends[friend].user_info.lang] += 1
-                if self.friends[friend].user_info.time_zone:
-                    self.friends_timezone[self.friends[friend].user_info.time_zone] += 1
+                if self.friends[friend].lang:
+                    self.friends_lang[self.friends[friend].lang] += 1
+                if self.friends[friend].time_zone:
+                    self.friends_timezone[self.friends[friend].time_zone] += 1
             except AttributeError:
                 if args.debug > 2:
                     print('Processing Friend {}'.format(friend))
@@ -550,7 +828,7 @@ class User():
     def get_friends_twitter_api(self):
         """ use the api for getting friends """
         try:
-            self.friends_ids = twitter_api.friends_ids(self.screen_name)
+            self.friends_ids = self.download_ids('friends')
         except tweepy.error.TweepError as e:
             try:
                 if e == 'Not authorized':
@@ -559,17 +837,58 @@ class User():
                     return False
                 elif e[0][0]['code'] == 63: # user suspended
                     return False
-                elif e[0][0]['code'] == 88: # Rate limit
-                    print("Rate limit exceeded to get friends data, we will sleep are retry in 15 minutes. The friends so far are stored.")
-                    # Sleep
-                    print('Waiting 5 minutes...')
-                    time.sleep(300)
-                    print('Resuming download...')
-                    # Warning, this can loop
-                    self.get_friends_twitter_api()
+                elif e[0][0]['code'] == 88: # Rate limit, the scheduler already waited and retried
+                    print("Rate limit exceeded to get friends data. Try again later.")
+                    return False
             except TypeError:
                 print e
 
+    def ids_expired(self, kind):
+        """
+        If the complete list of ids of the friends or followers (kind) has to be downloaded again.
+        The stored list is used until the profiles of all its ids are downloaded or it is older than --idsttl, so a large account
+        does not page all its ids again on every run just to download the next batch of profiles. An unfinished download is always continued.
+        """
+        store = get_store(self)
+        if store.has_ids_pages(kind):
+            return True
+        age = store.ids_age(kind + '_ids')
+        if age is None or age > args.idsttl * 3600:
+            return True
+        ids = getattr(self, kind + '_ids')
+        last_id = self.last_friend_retrieved_id if kind == 'friends' else self.last_follower_retrieved_id
+        return not len(ids) or last_id == ids[-1]
+
+    def download_ids(self, kind):
+        """
+        Download the complete list of ids of the friends or followers, using the cursor of twitter to ask page by page.
+        kind is 'friends' or 'followers'.
+        Each page is stored when it arrives together with the next cursor, so an interrupted download continues where it stopped.
+        Returns the ids in a numpy array.
+        """
+        store = get_store(self)
+        pages = store.load_ids_pages(kind)
+        if pages:
+            cursor = pages[-1][0]
+            print('Continuing the download of the {} ids after {} pages.'.format(kind, len(pages)))
+        else:
+            cursor = -1
+        # A cursor of 0 means there are no more pages
+        while cursor != 0:
+            ids, (previous_cursor, cursor) = rate_limiter.call(kind + '/ids', kind + '_ids', screen_name=self.screen_name, cursor=cursor)
+            page = numpy.array(ids, dtype=numpy.int64)
+            store.add_ids_page(kind, cursor, page)
+            pages.append((cursor, page))
+            if args.debug > 1:
+                print('Downloaded a page of {} {} ids.'.format(len(page), kind))
+        if pages:
+            ids = numpy.concatenate([page for cursor, page in pages])
+        else:
+            ids = numpy.array([], dtype=numpy.int64)
+        # The list is complete. Store it and delete the pages
+        store.finish_ids(kind, ids)
+        return ids
+
     def get_friends(self):
         """
         Get friends. Load friends from cache
@@ -580,86 +899,42 @@ class User():
         if args.offline or args.numfollowers <= 0:
             return True
         # If we are not offline and the user is not protected, try to get their friends
-        elif not args.offline and not self.protected and len(self.friends) != self.user_info.friends_count:
-            # Get the list of friends from twitter
-            self.get_friends_twitter_api()
+        elif not args.offline and not self.protected:
+            # Get the list of friends from twitter, unless the one we have is still being downloaded. It is asked also when the amount
+            # did not change, so a snapshot of the ids is kept when they changed
+            if self.ids_expired('friends'):
+                self.get_friends_twitter_api()
+            # Nothing to download if we have all of them and the list did not change since
+            if self.cached_count('friends') == self.user_info.friends_count and len(self.friends_ids) and self.last_friend_retrieved_id == self.friends_ids[-1]:
+                return True
             if args.debug > 0:
                 print('Total amount of friends this user follows: {}'.format(self.user_info.friends_count))
                 print('Total amount of friends downloaded in cache: {}'.format(len(self.friends)))
             # If the limit requested is > than the amount we already have, continue downloading from where we left
-            if self.last_friend_retrieved_id and self.last_friend_retrieved_id != self.friends_ids[-1]:
+            start = 0
+            if self.last_friend_retrieved_id and len(self.friends_ids) and self.last_friend_retrieved_id != self.friends_ids[-1]:
                 if args.debug > 0:
                     print('We didn\'t finished downloading the list of friends. Continuing...')
-                # We add one to download the list correctly
                 try:
-                    friends_to_continue_download = self.friends_ids[self.friends_ids.index(self.last_friend_retrieved_id) + 1:]
+                    start = self.resume_position('friends')
                 except ValueError:
                     print 'We had an issue here. The last friend, saved to restored downloading, is not a friend anymore'
-            else:
-                friends_to_continue_download = self.friends_ids
-            friends_to_download = friends_to_continue_download[:args.numfriends]
+            friends_to_download = self.friends_ids[start:][:args.numfriends]
             print('Friends to download: Next {} (user has {} friends, {} in our cache)'.format(len(friends_to_download), self.user_info.friends_count, len(self.friends)))
-            # We split the friends in groups in case we need to sleep because we are asking to much. Now not so used because we wait for the twitter exception
-            amount_users = 0
-            # This prints the bar
-            with tqdm(total=len(friends_to_download), unit="user") as pbar:
-                for friend_id in friends_to_download:
-                        try:
-                            pbar.update(1)
-                            if args.debug > 1:
-                                print('Downloading friend Nr {}: {}'.format(amount_users, friend_id))
-                            try:
-                                friend = twitter_api.get_user(friend_id)
-                            except tweepy.error.TweepError as e:
-                                try:
-                                    if e == 'Not authorized':
-                                        print('[+] The account of this user is protected, we can not get its friends.')
-                                    elif e[0][0]['code'] == 88 or e[0][0]['code'] == 50:
-                                        print("[+] Rate limit exceeded to get friends data, we will sleep are retry in 15 minutes. The friends so far are stored.")
-                                    # Store this user so far
-                                    pickle.dump(user, open( dirpath + name + '/' + name + '.data', "wb" ) )
-                                    # Sleep
-                                    print('Waiting 15 minutes...')
-                                    time.sleep(900)
-                                    print('Resuming download...')
-                                    # Retrieve the same last user that we couldn't before
-                                    friend = twitter_api.get_user(friend_id)
-                                    continue
-                                except TypeError:
-                                    # For some reason the error from twitter not always can be indexed...
-                                    print e
-                                    # catch all? What are we doing here?
-                                    print('Weird error {}'.format(e))
-                                    print('Save user just in case.')
-                                    pickle.dump(user, open( dirpath + name + '/' + name + '.data', "wb" ) )
-                            except Exception as e:
-                                # catch all? What are we doing here?
-                                print('Weird error {}'.format(e))
-                                print('Save user just in case.')
-                                pickle.dump(user, open( dirpath + name + '/' + name + '.data', "wb" ) )
-                            UserFriend = User(friend.screen_name)
-                            UserFriend.set_twitter_info(friend)
-                            self.friends[friend.screen_name] = UserFriend
-                            self.last_friend_retrieved_id = UserFriend.user_info.id
-                            amount_users += 1
-                        except KeyboardInterrupt:
-                            # Print Summary of detections in the last Time Window
-                            print('Keyboard Interrupt. Storing the user so far.')
-                            pickle.dump(user, open( dirpath + name + '/' + name + '.data', "wb" ) )
-                            return True
-            # Store the friends at the end
-            pickle.dump(user, open( dirpath + name + '/' + name + '.data', "wb" ) )
+            # Hydrate the friends in bulk, 100 at a time
+            self.hydrate_users(friends_to_download, 'friends', start)
         # Finally continue processing the friends
 
-    def print_followers_analysis(self):
+    def print_followers_analysis(self, process=True):
         """
         Analyze the followers of this user
         """
         # If the account is protected, we can not ask for its followers
         if not self.protected:
             try:
-                print('[+] Analyzing {} followers.'.format(len(self.followers)))
-                self.process_followers()
+                print('[+] Analyzing {} followers.'.format(self.cached_count('followers')))
+                if process:
+                    self.process_followers()
                 self.print_stats(self.followers_lang, "[+] Top Followers languages.", top=10)
                 self.print_stats(self.followers_timezone, "[+] Top Followers timezones.", top=10)
             except AttributeError:
@@ -671,10 +946,10 @@ class User():
         self.followers_lang = collections.Counter()
         for follower in self.followers:
             try:
-                if self.followers[follower].user_info.lang:
-                    self.followers_lang[self.followers[follower].user_info.lang] += 1
-                if self.followers[follower].user_info.time_zone:
-                    self.followers_timezone[self.followers[follower].user_info.time_zone] += 1
+                if self.followers[follower].lang:
+                    self.followers_lang[self.followers[follower].lang] += 1
+                if self.followers[follower].time_zone:
+                    self.followers_timezone[self.followers[follower].time_zone] += 1
             except AttributeError:
                 if args.debug > 2:
                     print('Processing Friend {}'.format(follower))
@@ -683,7 +958,7 @@ class User():
     def get_followers_twitter_api(self):
         """ use the api for getting followers """
         try:
-            self.followers_ids = twitter_api.followers_ids(self.screen_name)
+            self.followers_ids = self.download_ids('followers')
         except tweepy.error.TweepError as e:
             try:
                 if e == 'Not authorized':
@@ -692,14 +967,9 @@ class User():
                     return False
                 elif e[0][0]['code'] == 63: # user suspended
                     return False
-                elif e[0][0]['code'] == 88: # Rate limit
-                    print("Rate limit exceeded to get followers data, we will sleep are retry in 15 minutes. The followers so far are stored.")
-                    # Sleep
-                    print('Waiting 5 minutes...')
-                    time.sleep(300)
-                    print('Resuming download...')
-                    # Warning, this can loop
-                    self.get_followers_twitter_api()
+                elif e[0][0]['code'] == 88: # Rate limit, the scheduler already waited and retried
+                    print("Rate limit exceeded to get followers data. Try again later.")
+                    return False
             except TypeError:
                 print e
 
@@ -722,80 +992,163 @@ class User():
         if args.offline or args.numfollowers <= 0:
             return True
         # If we are not offline and the user is not protected, try to get their followers
-        elif not args.offline and not self.protected and len(self.followers) != self.user_info.followers_count:
-            # Get the list of followers from twitter
-            self.get_followers_twitter_api()
+        elif not args.offline and not self.protected:
+            # Get the list of followers from twitter, unless the one we have is still being downloaded. It is asked also when the amount
+            # did not change, so a snapshot of the ids is kept when they changed
+            if self.ids_expired('followers'):
+                self.get_followers_twitter_api()
+            # Nothing to download if we have all of them and the list did not change since
+            if self.cached_count('followers') == self.user_info.followers_count and len(self.followers_ids) and self.last_follower_retrieved_id == self.followers_ids[-1]:
+                return True
             if args.debug > 0:
                 print('Total amount of followers that follow this user: {}'.format(self.user_info.followers_count))
                 print('Total amount of followers downloaded in cache: {}'.format(len(self.followers)))
             # If the limit requested is > than the amount we already have, continue downloading from where we left
-            if self.last_follower_retrieved_id and self.last_follower_retrieved_id != self.followers_ids[-1]:
+            start = 0
+            if self.last_follower_retrieved_id and len(self.followers_ids) and self.last_follower_retrieved_id != self.followers_ids[-1]:
                 if args.debug > 0:
                     print('We didn\'t finished downloading the list of followers. Continuing...')
-                followers_to_continue_download = self.followers_ids[self.followers_ids.index(self.last_follower_retrieved_id) + 1:]
-            else:
-                followers_to_continue_download = self.followers_ids
-            followers_to_download = followers_to_continue_download[:args.numfollowers]
+                try:
+                    start = self.resume_position('followers')
+                except ValueError:
+                    print 'We had an issue here. The last follower, saved to restored downloading, is not a follower anymore'
+            followers_to_download = self.followers_ids[start:][:args.numfollowers]
             print('Followers to download: Next {} (user has {} followers, {} in our cache)'.format(len(followers_to_download), self.user_info.followers_count, len(self.followers)))
-            # We split the followers in groups in case we need to sleep because we are asking to much. Now not so used because we wait for the twitter exception
-            amount_users = 0
-            # This prints the bar
-            with tqdm(total=len(followers_to_download), unit="user") as pbar:
-                for follower_id in followers_to_download:
-                        try:
-                            pbar.update(1)
-                            if args.debug > 1:
-                                print('Downloading follower Nr {}: {}'.format(amount_users, follower_id))
-                            try:
-                                follower = twitter_api.get_user(follower_id)
-                            except tweepy.error.TweepError as e:
-                                try:
-                                    if e == 'Not authorized':
-                                        print('[+] The account of this user is protected, we can not get its followers.')
-                                    elif e[0][0]['code'] == 88 or e[0][0]['code'] == 50:
-                                        print("[+] Rate limit exceeded to get followers data, we will sleep are retry in 15 minutes. The followers so far are stored.")
-                                    # Store this user so far
-                                    pickle.dump(user, open( dirpath + name + '/' + name + '.data', "wb" ) )
-                                    # Sleep
-                                    print('Waiting 15 minutes...')
-                                    time.sleep(900)
-                                    print('Resuming download...')
-                                    # Retrieve the same last user that we couldn't before
-                                    follower = twitter_api.get_user(follower_id)
-                                    continue
-                                except TypeError:
-                                    # For some reason the error from twitter not always can be indexed...
-                                    print e
-                                    # catch all? What are we doing here?
-                                    print('Weird error {}'.format(e))
-                                    print('Save user just in case.')
-                                    pickle.dump(user, open( dirpath + name + '/' + name + '.data', "wb" ) )
-                            except Exception as e:
-                                # catch all? What are we doing here?
-                                print('Weird error {}'.format(e))
-                                print('Save user just in case.')
-                                pickle.dump(user, open( dirpath + name + '/' + name + '.data', "wb" ) )
-                            UserFriend = User(follower.screen_name)
-                            UserFriend.set_twitter_info(follower)
-                            self.followers[follower.screen_name] = UserFriend
-                            self.last_follower_retrieved_id = UserFriend.user_info.id
-                            amount_users += 1
-                        except KeyboardInterrupt:
-                            # Print Summary of detections in the last Time Window
-                            print('Keyboard Interrupt. Storing the user so far.')
-                            pickle.dump(user, open( dirpath + name + '/' + name + '.data', "wb" ) )
-                            return True
-            # Store the followers at the end
-            pickle.dump(user, open( dirpath + name + '/' + name + '.data', "wb" ) )
+            # Hydrate the followers in bulk, 100 at a time
+            self.hydrate_users(followers_to_download, 'followers', start)
         # Finally continue processing the followers
 
+    def resume_position(self, kind):
+        """
+        Position in the list of ids of the friends or followers (kind) right after the last one whose profile was downloaded.
+        The position of that id is stored with it, so it is only checked. The list is only searched if it changed since, like
+        when new followers came first. Raises ValueError if the id is not in the list anymore.
+        """
+        ids = getattr(self, kind + '_ids')
+        prefix = 'last_friend_retrieved_' if kind == 'friends' else 'last_follower_retrieved_'
+        last_id = getattr(self, prefix + 'id')
+        # Users stored by older versions do not have the position
+        position = getattr(self, prefix + 'position', None)
+        if position is None or position >= len(ids) or ids[position] != last_id:
+            position = id_position(ids, last_id)
+        return position + 1
+
+    def lookup_users(self, ids, save=None):
+        """
+        Ask twitter for the profiles of a batch of up to 100 ids using the bulk users/lookup API.
+        Returns the list of tweepy users found. Suspended or deleted accounts are not returned by twitter.
+        Returns None if the batch could not be asked, like when the rate limit is still exceeded after the retries, so it is asked again later.
+        save is called to store the user before waiting for the rate limit or after an error. By default the user is stored right away.
+        """
+        if save is None:
+            save = lambda: store_user(self)
+        try:
+            # If we have to wait for the rate limit, store the users so far
+            return rate_limiter.call('users/lookup', 'lookup_users', user_ids=ids, before_wait=save)
+        except tweepy.error.TweepError as e:
+            try:
+                code = e[0][0]['code']
+            except (TypeError, IndexError, KeyError):
+                code = None
+            if code == 17: # No user matches for specified terms
+                return []
+            # For some reason the error from twitter not always can be indexed...
+            print('Weird error {}'.format(e))
+            print('Save user just in case.')
+            save()
+            return None
+
+    def hydrate_users(self, ids_to_download, kind, start=0):
+        """
+        Download the profiles of a list of ids and store them in the friends or followers of this user.
+        kind is 'friends' or 'followers'. start is the position of the first id in the complete list of ids, to remember where we stopped.
+        The profiles already in the profile store of the cache and younger than --profilettl are taken from there.
+        The rest are asked in batches of LOOKUP_BATCH_SIZE, which is the maximum that users/lookup accepts, --connections batches at the same time.
+        """
+        neighbours = getattr(self, kind)
+        if kind == 'friends':
+            last_retrieved = 'last_friend_retrieved_id'
+            last_position = 'last_friend_retrieved_position'
+        else:
+            last_retrieved = 'last_follower_retrieved_id'
+            last_position = 'last_follower_retrieved_position'
+        if not len(ids_to_download):
+            return
+        profiles = get_profile_store()
+        cached = profiles.get_many(ids_to_download, max_age=args.profilettl * 3600)
+        for profile in cached.itervalues():
+            neighbours[profile.screen_name] = profile
+        run_stats.add('cache', 'profile_hits', len(cached))
+        # The positions of the missing ids in ids_to_download
+        missing = [position for position, user_id in enumerate(ids_to_download) if int(user_id) not in cached]
+        run_stats.add('cache', 'profile_misses', len(missing))
+        if args.debug > 0:
+            print('{} profiles of {} from the cache, {} to download'.format(len(cached), kind, len(missing)))
+        batches = [missing[position:position + LOOKUP_BATCH_SIZE] for position in range(0, len(missing), LOOKUP_BATCH_SIZE)]
+        # With several connections, the batches are asked by a pool of threads and the answers are added here in order.
+        # The threads can not store the user while we change it, so when one has to wait for the rate limit it asks us to store it
+        store_requested = threading.Event()
+        pool = ThreadPool(args.connections) if args.connections > 1 and len(batches) > 1 else None
+        stats_user = getattr(thread_data, 'stats_user', None)
+        def lookup(positions):
+            # The calls of the threads of the pool count for the user of this thread
+            run_stats.set_user(stats_user)
+            batch = [int(ids_to_download[missing_position]) for missing_position in positions]
+            return positions, batch, self.lookup_users(batch, save=store_requested.set if pool else None)
+        answers = pool.imap(lookup, batches) if pool else (lookup(positions) for positions in batches)
+        amount_users = 0
+        # After a batch that could not be asked, we can not say that the ids up to the next ones were done
+        failed = False
+        # This prints the bar
+        with progress_bar(total=len(ids_to_download), unit="user") as pbar:
+            pbar.update(len(cached))
+            try:
+                for positions, batch, found in answers:
+                    if args.debug > 1:
+                        print('Downloaded {} Nr {} to {}'.format(kind, amount_users, amount_users + len(batch)))
+                    amount_users += len(batch)
+                    if found is None:
+                        failed = True
+                        pbar.update(len(batch))
+                        continue
+                    downloaded = [Profile.from_twitter(profile) for profile in found]
+                    profiles.put_many(downloaded)
+                    for profile in downloaded:
+                        neighbours[profile.screen_name] = profile
+                    # users/lookup does not keep the order and skips suspended accounts, so we continue from the last id we asked for
+                    if not failed:
+                        setattr(self, last_retrieved, batch[-1])
+                        setattr(self, last_position, start + positions[-1])
+                    pbar.update(len(batch))
+                    if store_requested.is_set():
+                        store_requested.clear()
+                        store_user(self)
+            except KeyboardInterrupt:
+                # Print Summary of detections in the last Time Window
+                print('Keyboard Interrupt. Storing the user so far.')
+                if pool:
+                    pool.terminate()
+                store_user(self)
+                return True
+        if pool:
+            pool.close()
+        if failed:
+            print('Some batches of {} could not be downloaded. They are asked again the next time.'.format(kind))
+        else:
+            # All the ids are done, also the ones that came from the cache
+            setattr(self, last_retrieved, int(ids_to_download[-1]))
+            setattr(self, last_position, start + len(ids_to_download) - 1)
+        # Store the users at the end
+        store_user(self)
+
     def print_stats(self, dataset, text, top=5):
         """ Displays top values of something by order """
         sum = numpy.sum(list(dataset.values()))
         i = 0
         if sum:
             print(text + ' (Total {} objects in this category).'.format(len(list(dataset.values()))))
-            sorted_keys = sorted(dataset, key=dataset.get, reverse=True)
+            # Ties are sorted by name, so the output is the same however the counters were built
+            sorted_keys = sorted(dataset, key=lambda key: (-dataset[key], key))
             max_len_key = max([len(x) for x in sorted_keys][:top])  # use to adjust column width
             for k in sorted_keys:
                 try:
@@ -827,6 +1180,9 @@ class User():
                 else:
                     displayed_key = (int_to_weekday(key) if weekday else key)
                 chart.append((displayed_key, dataset[key]))
+            from ascii_graph import Pyasciigraph
+            from ascii_graph.colors import Gre, Yel, Red
+            from ascii_graph.colordata import hcolor
             thresholds = {
                 int(mean): Gre, int(mean * 2): Yel, int(mean * 3): Red,
             }
@@ -836,119 +1192,1281 @@ class User():
                 multivalue=False,
                 human_readable='si',
             )
-            for line in graph.graph(title + ' ({} tweets)'.format(len(self.tweets)), data):
+            for line in graph.graph(title + ' ({} tweets)'.format(self.cached_count('tweets')), data):
                 print('{}'.format(line))
             print("")
 
-def plot_users(users, dirpath):
-    """ Read the friends of these users from a file and plot a graph"""
-    print('Plotting a unique graph for all users')
-    #pygraph = pydot.Dot(graph_type='graph', resolution='1400000')
-    #pygraph = pydot.Dot(graph_type='graph', resolution='32000')
-    pygraph = pydot.Dot(graph_type='graph', resolution='300')
-    #pygraph.set('center', '1')
-    #pygraph.set('ratio', 'auto')
-    pygraph.set_fontsize('21')
-    #pygraph.set_ranksep('4 equally')
-    #pygraph.set_rankdir('LR')
-    counter_papa = {}
-    color_node = {}
-    counter_for_user = 0
-    # First count how many times each node is referenced
-    for user in users.split(','):
-        # read their friends
+class RateLimiter():
+    """
+    Schedules the calls to the twitter API.
+    Each endpoint has its own budget of calls, taken from the x-rate-limit headers that twitter sends with every answer.
+    When the budget of an endpoint is exhausted, only the calls to that endpoint wait, and exactly until its window reopens.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Calls left and epoch when the window reopens, by endpoint. None while unknown
+        self.remaining = {}
+        self.reset = {}
+        # Seconds waited, by endpoint
+        self.waited = collections.Counter()
+
+    def update(self, endpoint, response):
+        """
+        Update the budget of an endpoint from the headers of a twitter answer
+        """
+        if response is None:
+            return
+        remaining = response.headers.get('x-rate-limit-remaining')
+        reset = response.headers.get('x-rate-limit-reset')
+        with self.lock:
+            if remaining is not None:
+                remaining = int(remaining)
+                # The answers of calls made at the same time arrive in any order. In the same window the budget only goes down
+                if reset is not None and int(reset) == self.reset.get(endpoint) and self.remaining.get(endpoint) is not None:
+                    remaining = min(remaining, self.remaining[endpoint])
+                self.remaining[endpoint] = remaining
+            if reset is not None:
+                self.reset[endpoint] = int(reset)
+
+    def exhausted(self, endpoint):
+        """
+        Mark the budget of an endpoint as used. If twitter did not tell us when it reopens, wait a whole window
+        """
+        with self.lock:
+            self.remaining[endpoint] = 0
+            if self.reset.get(endpoint, 0) <= time.time():
+                self.reset[endpoint] = int(time.time()) + RATE_LIMIT_WINDOW
+
+    def take(self, endpoint):
+        """
+        Take one call from the budget of the endpoint.
+        Returns the seconds to wait until the window reopens, or 0 if we can call now.
+        """
+        with self.lock:
+            remaining = self.remaining.get(endpoint)
+            reset = self.reset.get(endpoint, 0)
+            if remaining is None or reset <= time.time():
+                # Unknown budget or a new window. The answer will tell us the real budget
+                self.remaining[endpoint] = None
+                return 0
+            if remaining > 0:
+                self.remaining[endpoint] = remaining - 1
+                return 0
+            # One extra second, to be sure the window is open in twitter
+            return reset - time.time() + 1
+
+    def wait(self, endpoint, before_wait=None):
+        """
+        Wait until there is budget to call the endpoint
+        """
+        wait_time = self.take(endpoint)
+        while wait_time > 0:
+            print('[+] Rate limit of {} exhausted. Waiting {} seconds until it reopens...'.format(endpoint, int(wait_time)))
+            if before_wait:
+                before_wait()
+            time.sleep(wait_time)
+            self.waited[endpoint] += wait_time
+            run_stats.add('sleep_seconds', endpoint, wait_time)
+            wait_time = self.take(endpoint)
+
+    def call(self, endpoint, method_name, *args, **kwargs):
+        """
+        Call a method of the twitter API through the scheduler. before_wait is called before waiting for the rate limit.
+        """
+        before_wait = kwargs.pop('before_wait', None)
+        attempts = 0
+        while True:
+            self.wait(endpoint, before_wait)
+            api = current_api()
+            run_stats.add('api_calls', endpoint)
+            try:
+                result = getattr(api, method_name)(*args, **kwargs)
+                self.update(endpoint, api.last_response)
+                return result
+            except tweepy.error.TweepError as e:
+                self.update(endpoint, e.response)
+                attempts += 1
+                rate_limited = isinstance(e, tweepy.error.RateLimitError) or (e.response is not None and e.response.status_code == 429)
+                if not rate_limited or attempts >= RATE_LIMIT_RETRIES:
+                    raise
+                self.exhausted(endpoint)
+
+# The scheduler of all the calls to twitter. Shared by all the threads
+rate_limiter = RateLimiter()
+# Data of each thread, like its own connection to twitter
+thread_data = threading.local()
+
+class RunStats():
+    """
+    Measures of the run, per user and for the whole run: seconds of each phase, calls to twitter by endpoint,
+    seconds sleeping for the rate limits by endpoint, bytes read and written in the cache, and cache hits and misses.
+    The measures are assigned to the user that the thread is processing.
+    Reading the tweets, friends and followers from the cache when they are first used is measured as the cache_load phase,
+    and also counts in the phase that used them.
+    """
+    CATEGORIES = ('seconds', 'api_calls', 'sleep_seconds', 'bytes', 'cache')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.users = OrderedDict()
+
+    def set_user(self, name):
+        """ The following measures of this thread belong to this user """
+        thread_data.stats_user = name
+
+    def add(self, category, key, amount=1):
+        name = getattr(thread_data, 'stats_user', None) or '(run)'
+        with self.lock:
+            if name not in self.users:
+                self.users[name] = {category: collections.Counter() for category in self.CATEGORIES}
+            self.users[name][category][key] += amount
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """ Measure the seconds of a phase of the program """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add('seconds', name, time.time() - start)
+
+    def merge(self, name, measures):
+        """ Add the measures of a user taken in another process """
+        with self.lock:
+            if name not in self.users:
+                self.users[name] = {category: collections.Counter() for category in self.CATEGORIES}
+            for category in self.CATEGORIES:
+                self.users[name][category].update(measures.get(category, {}))
+
+    def totals(self):
+        """ The measures of all the users added """
+        totals = {category: collections.Counter() for category in self.CATEGORIES}
+        with self.lock:
+            for measures in self.users.values():
+                for category in self.CATEGORIES:
+                    totals[category].update(measures[category])
+        return totals
+
+    def as_dict(self):
+        with self.lock:
+            users = OrderedDict((name, {category: dict(measures[category]) for category in self.CATEGORIES}) for name, measures in self.users.items())
+        return {'wall_seconds': time.time() - self.start, 'users': users, 'total': {category: dict(counter) for category, counter in self.totals().items()}}
+
+    def print_report(self, form):
+        """
+        Print the measures as json or as a compact table, one row per user and the total
+        """
+        if form == 'json':
+            print(json.dumps(self.as_dict(), indent=2, sort_keys=True))
+            return
+        with self.lock:
+            rows = [(name, measures) for name, measures in self.users.items()]
+        rows.append(('TOTAL', self.totals()))
+        # The phases in the order they happened
+        phases = []
+        for name, measures in rows:
+            phases.extend(phase for phase in measures['seconds'] if phase not in phases)
+        width = max([len(name) for name, measures in rows] + [5])
+        print('\n[+] Run stats. Wall time {:.2f} s. Phases in seconds, bytes in KB.'.format(time.time() - self.start))
+        print('{:{}} '.format('User', width) + ' '.join('{:>{}}'.format(phase, max(len(phase), 8)) for phase in phases) + ' {:>8} {:>10} {:>10} {:>10} {:>6} {:>6}'.format('API', 'Sleep', 'Read', 'Written', 'Hits', 'Misses'))
+        for name, measures in rows:
+            print('{:{}} '.format(name, width) + ' '.join('{:{}.2f}'.format(measures['seconds'][phase], max(len(phase), 8)) for phase in phases) +
+                  ' {:8} {:10.2f} {:10.1f} {:10.1f} {:6} {:6}'.format(sum(measures['api_calls'].values()), sum(measures['sleep_seconds'].values()),
+                  measures['bytes']['read'] / 1024.0, measures['bytes']['written'] / 1024.0, measures['cache']['hits'], measures['cache']['misses']))
+        api_calls = rows[-1][1]['api_calls']
+        if api_calls:
+            print('[+] API calls: ' + ', '.join('{} {}'.format(endpoint, calls) for endpoint, calls in sorted(api_calls.items())))
+
+# Measures of this run
+run_stats = RunStats()
+
+class NoProgressBar(object):
+    """
+    Stand-in of a tqdm progress bar that shows nothing
+    """
+    def __init__(self, iterable=None, **kwargs):
+        self.iterable = iterable
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+    def update(self, n=1):
+        pass
+
+def progress_bar(*args, **kwargs):
+    """
+    A tqdm progress bar. Worker threads do not show it, since tqdm bars of several threads break each other
+    """
+    if getattr(thread_data, 'worker', False):
+        return NoProgressBar(*args, **kwargs)
+    from tqdm import tqdm
+    # tqdm binds its default file to the stderr of the moment it is imported. Use the current one
+    kwargs.setdefault('file', sys.stderr)
+    return tqdm(*args, **kwargs)
+
+def current_api():
+    """
+    The twitter API of this thread. Worker threads have their own, the main thread uses the global one
+    """
+    return getattr(thread_data, 'twitter_api', twitter_api)
+
+class TwitterClient():
+    """
+    Our own client of the twitter REST API, with the methods of tweepy.API that we use: get_user, user_timeline, friends_ids, followers_ids and lookup_users.
+    tweepy opens a new connection for every call. Here all the threads share one requests session with a pool of keep-alive connections,
+    so the calls made at the same time do not wait for each other. The answers are parsed into the same tweepy models.
+    base_url can point to a local server that stands in for twitter.
+    """
+    def __init__(self, auth=None, base_url=API_URL, connections=1):
+        import requests
+        self.base_url = base_url.rstrip('/') + '/'
+        self.auth = auth.apply_auth() if auth else None
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # The answer of the last call of each thread, read by the rate limit scheduler
+        self.responses = threading.local()
+        # The models look for the classes to create in the parser of their api
+        self.parser = tweepy.parsers.ModelParser()
+
+    @property
+    def last_response(self):
+        return getattr(self.responses, 'last', None)
+
+    def request(self, method, path, parameters):
+        """
+        Call an endpoint and return its json. The errors are raised as the same tweepy errors
+        """
+        import requests
+        parameters = {key: value for key, value in parameters.iteritems() if value is not None}
+        try:
+            if method == 'GET':
+                response = self.session.get(self.base_url + path + '.json', params=parameters, auth=self.auth, timeout=HTTP_TIMEOUT)
+            else:
+                response = self.session.post(self.base_url + path + '.json', data=parameters, auth=self.auth, timeout=HTTP_TIMEOUT)
+        except requests.RequestException as e:
+            raise tweepy.error.TweepError('Failed to send request: {}'.format(e))
+        self.responses.last = response
+        if response.status_code != 200:
+            try:
+                reason, api_code = self.parser.parse_error(response.text)
+            except Exception:
+                reason, api_code = 'Twitter error response: status code = {}'.format(response.status_code), None
+            if tweepy.error.is_rate_limit_error_message(reason):
+                raise tweepy.error.RateLimitError(reason, response)
+            raise tweepy.error.TweepError(reason, response, api_code=api_code)
+        return response.json()
+
+    def get_user(self, screen_name):
+        return tweepy.models.User.parse(self, self.request('GET', 'users/show', {'screen_name': screen_name}))
+
+    def user_timeline(self, **parameters):
+        return tweepy.models.Status.parse_list(self, self.request('GET', 'statuses/user_timeline', parameters))
+
+    def ids(self, path, parameters):
+        """ A page of ids, and the previous and next cursors """
+        answer = self.request('GET', path, parameters)
+        return answer['ids'], (answer.get('previous_cursor', 0), answer.get('next_cursor', 0))
+
+    def friends_ids(self, **parameters):
+        return self.ids('friends/ids', parameters)
+
+    def followers_ids(self, **parameters):
+        return self.ids('followers/ids', parameters)
+
+    def lookup_users(self, user_ids=None, screen_names=None):
+        parameters = {}
+        if user_ids:
+            parameters['user_id'] = ','.join(str(user_id) for user_id in user_ids)
+        if screen_names:
+            parameters['screen_name'] = ','.join(screen_names)
+        return tweepy.models.User.parse_list(self, self.request('POST', 'users/lookup', parameters))
+
+class Profile(object):
+    """
+    A compact record of a friend or follower.
+    Only the fields of the twitter profile that the analysis and exports use are kept, instead of a full User.
+    """
+    __slots__ = PROFILE_FIELDS
+
+    def __init__(self, **fields):
+        for field in PROFILE_FIELDS:
+            setattr(self, field, fields.get(field))
+
+    @classmethod
+    def from_twitter(cls, twitter_user):
+        """ Create the record from a tweepy user """
+        return cls(**{field: getattr(twitter_user, field, None) for field in PROFILE_FIELDS})
+
+    @property
+    def user_info(self):
+        """ So the record can be used where a User with its twitter info was used before """
+        return self
+
+    def __getstate__(self):
+        return tuple(getattr(self, field) for field in PROFILE_FIELDS)
+
+    def __setstate__(self, state):
+        for field, value in zip(PROFILE_FIELDS, state):
+            setattr(self, field, value)
+
+    def __repr__(self):
+        return 'Profile(id={}, screen_name={})'.format(self.id, self.screen_name)
+
+def tweet_text(tweet):
+    """
+    The text of a tweet. Tweets downloaded in extended mode have the complete text in full_text
+    """
+    return getattr(tweet, 'full_text', None) or getattr(tweet, 'text', '')
+
+def get_sentiment_client():
+    """
+    The client of the sentiment analysis. It needs sentiment(text, lang) and detect_language(text), like the repustate client.
+    If it has bulk_sentiment(items, lang), with items as dicts of 'id' and 'text' and answering {'results': [{'id', 'score'}]}, it is used to score a batch in one call.
+    """
+    global sentiment_client
+    if sentiment_client is None:
+        from secrets import repustate_client
+        sentiment_client = repustate_client
+    return sentiment_client
+
+def score_sentiments(client, language, tweets):
+    """
+    Score a batch of tweets of the same language. If the language is None, it is detected for each tweet.
+    Returns a list of (tweet id, score). Each request fails on its own: if the bulk request fails the tweets are scored one by one,
+    and the tweets that fail are not scored, so they are tried again next time.
+    """
+    if language and hasattr(client, 'bulk_sentiment'):
+        items = [{'id': str(tweet.id), 'text': tweet_text(tweet).encode('utf-8')} for tweet in tweets]
+        try:
+            answer = client.bulk_sentiment(items, lang=language)
+            return [(int(result['id']), float(result['score'])) for result in answer['results']]
+        except Exception as inst:
+            print('Problem in analyze_sentiments() with the batch of {} tweets in language {}. Scoring them one by one.'.format(len(tweets), language))
+            print(type(inst))     # the exception instance
+            print(inst.args)      # arguments stored in .args
+    scores = []
+    for tweet in tweets:
+        try:
+            text = tweet_text(tweet).encode('utf-8')
+            tweet_language = language or client.detect_language(text)['language']
+            scores.append((tweet.id, float(client.sentiment(text, lang=tweet_language)['score'])))
+        except Exception as inst:
+            print('Problem in analyze_sentiments() with the tweet {} in language {}'.format(tweet.id, language))
+            print(type(inst))     # the exception instance
+            print(inst.args)      # arguments stored in .args
+    return scores
+
+class Reference(object):
+    """
+    A friend or follower that the store of a user has as a reference to the profile store
+    """
+    __slots__ = ('profile',)
+
+    def __init__(self, profile):
+        self.profile = profile
+
+def compact_profile(neighbour):
+    """
+    Convert a friend or follower stored as a full User by older versions to a Profile.
+    Returns None if it was already a Profile.
+    """
+    if isinstance(neighbour, Profile):
+        return None
+    if neighbour.user_info:
+        return Profile.from_twitter(neighbour.user_info)
+    return Profile(screen_name=neighbour.screen_name)
+
+class UserStore():
+    """
+    Incremental disk storage of one user in a sqlite file.
+    The profile and statistics of the user are one small record. The tweets, friends and followers are one row each,
+    so storing the user only writes the objects that are new or changed, and loading them is done only when they are used.
+    The lists of ids of the friends and followers are raw int64 files next to it, mapped in memory when they are used.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS meta (key PRIMARY KEY, data BLOB)')
+            for table in LAZY_ATTRIBUTES:
+                self.db.execute('CREATE TABLE IF NOT EXISTS {} (key PRIMARY KEY, data BLOB)'.format(table))
+            # The complete lists of ids of friends and followers of older versions, and the pages of the downloads not finished yet
+            self.db.execute('CREATE TABLE IF NOT EXISTS ids (key PRIMARY KEY, data BLOB)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS ids_pages (kind, next_cursor, data BLOB)')
+            # Sorted ids of the friends and followers each time their complete list was downloaded
+            self.db.execute('CREATE TABLE IF NOT EXISTS snapshots (kind, taken_at REAL, data BLOB)')
+            # The sentiment score of each tweet
+            self.db.execute('CREATE TABLE IF NOT EXISTS sentiments (key PRIMARY KEY, score REAL)')
+        # The objects as they are on disk, by table, and the lists of ids. Used to know which ones are new when storing
+        self.stored = {}
+        self.stored_ids = {}
+        # The lists of ids are kept in files next to the sqlite file, <name>.friends_ids.int64 and <name>.followers_ids.int64
+        self.ids_base = os.path.join(os.path.dirname(path), os.path.basename(path).split('.')[0])
+
+    def load(self, screen_name):
+        """
+        Load the user from the store. The tweets, friends and followers are not read until they are used.
+        Returns False if the user was never stored.
+        """
+        row = self.db.execute('SELECT data FROM meta WHERE key = ?', ('user',)).fetchone()
+        if not row:
+            return False
+        run_stats.add('bytes', 'read', len(row[0]))
+        user = User(screen_name)
+        for attribute in LAZY_ATTRIBUTES:
+            del user.__dict__[attribute]
+        for attribute in ID_ATTRIBUTES:
+            del user.__dict__[attribute]
+        user.__dict__.update(unpickle(row[0]))
+        # Older versions stored the ids as lists inside the user
+        for attribute in ID_ATTRIBUTES:
+            if attribute in user.__dict__:
+                user.__dict__[attribute] = numpy.array(list(user.__dict__[attribute]), dtype=numpy.int64)
+        user._store = self
+        return user
+
+    def load_objects(self, table):
+        """
+        Read all the objects of a table. Tweets are sorted from the newest to the oldest, as twitter gives them.
+        """
+        if table == 'tweets':
+            objects = OrderedDict()
+            rows = self.db.execute('SELECT key, data FROM tweets ORDER BY key DESC')
+        else:
+            objects = {}
+            rows = self.db.execute('SELECT key, data FROM {} ORDER BY rowid'.format(table))
+        stored = {}
+        for key, value in self.resolve_profiles(table, rows):
+            if table != 'tweets' and not isinstance(value, Reference):
+                # Friends and followers stored whole by older versions are written again as references the next time
+                profile = compact_profile(value) or value
+                objects[key] = profile
+                if profile.id is None:
+                    stored[key] = profile
+                continue
+            objects[key] = value.profile if table != 'tweets' else value
+            stored[key] = objects[key]
+        self.stored[table] = stored
+        return objects
+
+    def load_tweets_outside(self, first, last, ids=()):
+        """
+        Read only the tweets with ids below first or above last, and the ones in ids, from the newest to the oldest. They are not kept as loaded
+        """
+        tweets = dict(self.resolve_profiles('tweets', self.db.execute('SELECT key, data FROM tweets WHERE key > ? OR key < ?', (last, first))))
+        ids = [id for id in ids if id not in tweets]
+        for position in range(0, len(ids), SQLITE_MAX_VARIABLES):
+            chunk = ids[position:position + SQLITE_MAX_VARIABLES]
+            rows = self.db.execute('SELECT key, data FROM tweets WHERE key IN ({})'.format(','.join('?' * len(chunk))), chunk)
+            tweets.update(self.resolve_profiles('tweets', rows))
+        return [tweets[id] for id in sorted(tweets, reverse=True)]
+
+    def resolve_profiles(self, table, rows):
+        """
+        Unpickle the rows of a table. The friends and followers stored as a reference to the profile store are given as a Reference with its profile
+        """
+        chunk = []
+        for key, data in rows:
+            run_stats.add('bytes', 'read', len(data))
+            chunk.append((key, unpickle(data)))
+            if len(chunk) == SQLITE_MAX_VARIABLES:
+                for row in self.resolve_chunk(table, chunk):
+                    yield row
+                chunk = []
+        for row in self.resolve_chunk(table, chunk):
+            yield row
+
+    def resolve_chunk(self, table, chunk):
+        if table == 'tweets':
+            return chunk
+        ids = [value for key, value in chunk if isinstance(value, (int, long))]
+        profiles = get_profile_store().get_many(ids) if ids else {}
+        resolved = []
+        for key, value in chunk:
+            if isinstance(value, (int, long)):
+                # A profile missing from the profile store keeps at least its id and name
+                value = Reference(profiles.get(value) or Profile(id=value, screen_name=key))
+            resolved.append((key, value))
+        return resolved
+
+    def ids_path(self, attribute):
+        """
+        The file of the complete list of ids of the friends or followers. It is a raw array of int64
+        """
+        return '{}.{}.int64'.format(self.ids_base, attribute)
+
+    def load_ids(self, attribute):
+        """
+        The complete list of ids of the friends or followers, as a read only array mapped from its file.
+        Nothing is read until the ids are used, and then only the parts used. Lists of older versions are read from the ids table.
+        """
+        path = self.ids_path(attribute)
+        if os.path.exists(path):
+            # numpy can not map an empty file
+            if os.path.getsize(path):
+                ids = numpy.memmap(path, dtype=numpy.int64, mode='r')
+            else:
+                ids = numpy.array([], dtype=numpy.int64)
+        else:
+            row = self.db.execute('SELECT data FROM ids WHERE key = ?', (attribute,)).fetchone()
+            if row:
+                run_stats.add('bytes', 'read', len(row[0]))
+                ids = numpy.frombuffer(str(row[0]), dtype=numpy.int64)
+            else:
+                ids = numpy.array([], dtype=numpy.int64)
+        self.stored_ids[attribute] = ids
+        return ids
+
+    def write_ids(self, attribute, ids):
+        """
+        Write the complete list of ids of the friends or followers to its file. Returns the amount of bytes written.
+        The file is replaced at once, so the arrays already mapped from the old one are still valid. Runs inside the transaction of the caller.
+        """
+        path = self.ids_path(attribute)
+        data = numpy.asarray(ids, dtype=numpy.int64)
+        data.tofile(path + '.tmp')
+        os.rename(path + '.tmp', path)
+        # The list of older versions is not needed anymore
+        self.db.execute('DELETE FROM ids WHERE key = ?', (attribute,))
+        self.stored_ids[attribute] = ids
+        return data.nbytes
+
+    def ids_age(self, attribute):
+        """
+        Seconds since the complete list of ids of the friends or followers was written to its file. None if there is no file
+        """
+        path = self.ids_path(attribute)
+        if not os.path.exists(path):
+            return None
+        return time.time() - os.path.getmtime(path)
+
+    def has_ids_pages(self, kind):
+        """
+        If there is an unfinished download of the ids of the friends or followers
+        """
+        return self.db.execute('SELECT 1 FROM ids_pages WHERE kind = ? LIMIT 1', (kind,)).fetchone() is not None
+
+    def load_ids_pages(self, kind):
+        """
+        Read the pages of ids of an unfinished download. Returns a list of (next cursor, ids)
+        """
+        rows = self.db.execute('SELECT next_cursor, data FROM ids_pages WHERE kind = ? ORDER BY rowid', (kind,)).fetchall()
+        run_stats.add('bytes', 'read', sum(len(data) for next_cursor, data in rows))
+        return [(next_cursor, numpy.frombuffer(str(data), dtype=numpy.int64)) for next_cursor, data in rows]
+
+    def add_ids_page(self, kind, next_cursor, ids):
+        """
+        Store a page of ids as soon as it is downloaded
+        """
+        with self.db:
+            self.db.execute('INSERT INTO ids_pages VALUES (?, ?, ?)', (kind, next_cursor, sqlite3.Binary(ids.tobytes())))
+        run_stats.add('bytes', 'written', ids.nbytes)
+
+    def finish_ids(self, kind, ids):
+        """
+        Store the complete list of ids of a finished download and delete its pages.
+        A snapshot of the ids is kept if they changed since the last one.
+        """
+        snapshot = numpy.unique(ids)
+        last = self.db.execute('SELECT data FROM snapshots WHERE kind = ? ORDER BY taken_at DESC LIMIT 1', (kind,)).fetchone()
+        changed = last is None or not numpy.array_equal(numpy.frombuffer(str(last[0]), dtype=numpy.int64), snapshot)
+        with self.db:
+            # The list is written before the pages are deleted, so an interruption between them only downloads the last page again
+            written = self.write_ids(kind + '_ids', ids)
+            self.db.execute('DELETE FROM ids_pages WHERE kind = ?', (kind,))
+            if changed:
+                self.db.execute('INSERT INTO snapshots VALUES (?, ?, ?)', (kind, time.time(), sqlite3.Binary(snapshot.tobytes())))
+        run_stats.add('bytes', 'written', written + (snapshot.nbytes if changed else 0))
+
+    def load_sentiments(self):
+        """
+        The sentiment scores of the tweets, by tweet id
+        """
+        return dict(self.db.execute('SELECT key, score FROM sentiments'))
+
+    def add_sentiments(self, scores):
+        """
+        Store the sentiment scores of tweets, a list of (tweet id, score)
+        """
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO sentiments VALUES (?, ?)', scores)
+
+    def iter_objects(self, table):
+        """
+        Read the objects of a table one by one, without keeping them. Tweets are given from the newest to the oldest.
+        """
+        order = 'key DESC' if table == 'tweets' else 'rowid'
+        for key, value in self.resolve_profiles(table, self.db.execute('SELECT key, data FROM {} ORDER BY {}'.format(table, order))):
+            if isinstance(value, Reference):
+                value = value.profile
+            elif table != 'tweets':
+                value = compact_profile(value) or value
+            yield key, value
+
+    def list_snapshots(self, kind):
+        """
+        The snapshots of the ids of the friends or followers, oldest first, as a list of (rowid, time taken, amount of ids). The ids are not read
+        """
+        return self.db.execute('SELECT rowid, taken_at, length(data) / 8 FROM snapshots WHERE kind = ? ORDER BY taken_at', (kind,)).fetchall()
+
+    def load_snapshot(self, rowid):
+        """
+        The sorted ids of a snapshot
+        """
+        data = self.db.execute('SELECT data FROM snapshots WHERE rowid = ?', (rowid,)).fetchone()[0]
+        run_stats.add('bytes', 'read', len(data))
+        return numpy.frombuffer(str(data), dtype=numpy.int64)
+
+    def count(self, table):
+        """
+        Amount of objects in a table, without loading them
+        """
+        return self.db.execute('SELECT COUNT(*) FROM {}'.format(table)).fetchone()[0]
+
+    def save(self, user):
+        """
+        Store the user. Only the tweets, friends and followers that are not yet on disk are written.
+        """
+        state = user.__getstate__()
+        for attribute in LAZY_ATTRIBUTES + ID_ATTRIBUTES:
+            state.pop(attribute, None)
+        written = 0
+        with self.db:
+            data = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+            written += len(data)
+            self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', ('user', sqlite3.Binary(data)))
+            for attribute in ID_ATTRIBUTES:
+                if attribute in user.__dict__ and self.stored_ids.get(attribute) is not user.__dict__[attribute]:
+                    written += self.write_ids(attribute, user.__dict__[attribute])
+            for table in LAZY_ATTRIBUTES:
+                # If the objects were never loaded, they did not change
+                if table not in user.__dict__:
+                    continue
+                current = user.__dict__[table]
+                stored = self.stored.get(table, {})
+                changed = [(key, value) for key, value in current.iteritems() if stored.get(key) is not value]
+                if table != 'tweets':
+                    # The profiles of friends and followers are kept once in the profile store, and here only their id
+                    profiles = [value for key, value in changed if isinstance(value, Profile) and value.id is not None]
+                    get_profile_store().add_missing(profiles)
+                    changed = [(key, int(value.id) if isinstance(value, Profile) and value.id is not None else value) for key, value in changed]
+                new_objects = [(key, sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))) for key, value in changed]
+                deleted_objects = [(key,) for key in stored if key not in current]
+                written += sum(len(data) for key, data in new_objects)
+                self.db.executemany('INSERT OR REPLACE INTO {} VALUES (?, ?)'.format(table), new_objects)
+                self.db.executemany('DELETE FROM {} WHERE key = ?'.format(table), deleted_objects)
+                self.stored[table] = dict(current)
+        run_stats.add('bytes', 'written', written)
+
+def find_class(module, name):
+    """
+    Objects pickled while running as a script belong to __main__, and while imported to twitter_profiler. Both are this module.
+    """
+    if module in ('__main__', 'twitter_profiler'):
+        return getattr(sys.modules[__name__], name)
+    __import__(module)
+    return getattr(sys.modules[module], name)
+
+def unpickle(data):
+    """
+    Load a pickled object, finding our own classes in this module
+    """
+    unpickler = pickle.Unpickler(StringIO(str(data)))
+    unpickler.find_global = find_class
+    return unpickler.load()
+
+def user_in_cache(name):
+    """
+    Is this user stored in the cache?
+    """
+    userpath = dirpath + name + '/' + name
+    return os.path.exists(userpath + '.db') or os.path.exists(userpath + '.data')
+
+def migrate_user(name):
+    """
+    Convert the old <name>.data pickle of a user to the sqlite store.
+    The pickle is kept renamed as <name>.data.migrated
+    """
+    userpath = dirpath + name + '/' + name
+    print('Migrating the cache of {} to the new store.'.format(name))
+    user = unpickle(open(userpath + '.data', 'rb').read())
+    for neighbours in (user.friends, getattr(user, 'followers', {})):
+        for key in neighbours:
+            neighbours[key] = compact_profile(neighbours[key]) or neighbours[key]
+    # Write in a temporal file, so an interrupted migration is done again next time
+    store = UserStore(userpath + '.db.tmp')
+    store.save(user)
+    store.db.close()
+    os.rename(userpath + '.db.tmp', userpath + '.db')
+    os.rename(userpath + '.data', userpath + '.data.migrated')
+
+def migrate_cache():
+    """
+    Migrate all the users in the cache that are still stored as pickles
+    """
+    for name in sorted(listdir(dirpath)):
+        userpath = dirpath + name + '/' + name
+        if os.path.exists(userpath + '.data') and not os.path.exists(userpath + '.db'):
+            migrate_user(name)
+
+def load_user(name):
+    """
+    Load a user from the cache. If it is not in the cache, return a new user.
+    The folder of the user should already exist.
+    """
+    userpath = dirpath + name + '/' + name
+    if os.path.exists(userpath + '.data') and not os.path.exists(userpath + '.db'):
+        migrate_user(name)
+    store = UserStore(userpath + '.db')
+    user = store.load(name)
+    if not user:
+        run_stats.add('cache', 'misses')
+        user = User(name)
+        user._store = store
+    else:
+        run_stats.add('cache', 'hits')
+    return user
+
+def get_store(user):
+    """
+    The disk store of the user. It is created if the user was never stored
+    """
+    try:
+        return user._store
+    except AttributeError:
+        user._store = UserStore(dirpath + user.screen_name + '/' + user.screen_name + '.db')
+        return user._store
+
+def store_user(user, index=True):
+    """
+    Store the user in the cache. Only the new data is written.
+    Without index the row of the user in the index of the cache is not updated, the worker processes leave it to the parent.
+    """
+    with run_stats.phase('cache_store'):
+        get_store(user).save(user)
+        if index:
+            get_manifest().update(user)
+
+class Manifest():
+    """
+    Index of the users in the cache, one row per user with its main numbers, and the counters of the analysis of their tweets.
+    It is updated every time a user is stored, so listing, selecting and querying users does not need to load them.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # Indexes of older versions do not have the counters. They have to be rebuilt once
+        self.missing_counters = not self.db.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'counters'").fetchone()
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS users (screen_name PRIMARY KEY, id, followers_count, friends_count, statuses_count, tweets_cached, friends_cached, followers_cached, cache_size, last_refresh, label)')
+            # One row per value of each counter of each user. field is the name of the counter in QUERY_COUNTERS.
+            # The rows are kept sorted by field and value, so merging a counter of all the users reads it in order and nothing else
+            self.db.execute('CREATE TABLE IF NOT EXISTS counters (field, key, screen_name, count, PRIMARY KEY (field, key, screen_name)) WITHOUT ROWID')
+            self.db.execute('CREATE INDEX IF NOT EXISTS counters_by_user ON counters (screen_name)')
+
+    def update(self, user):
+        """
+        Update the row of a user
+        """
+        self.write(*Manifest.entry(user))
+
+    @staticmethod
+    def entry(user):
+        """
+        The row of a user and the rows of its counters. They can be computed in a worker process and written by the parent
+        """
+        info = user.user_info
+        if user.label:
+            label = '{}:{}'.format(user.label['label_what'], ','.join(user.label['label_how']))
+        else:
+            label = None
+        try:
+            cache_size = os.path.getsize(user._store.path)
+        except (AttributeError, OSError):
+            cache_size = None
+        row = (user.screen_name,
+               getattr(info, 'id', None),
+               getattr(info, 'followers_count', None),
+               getattr(info, 'friends_count', None),
+               getattr(info, 'statuses_count', None),
+               user.cached_count('tweets'), user.cached_count('friends'), user.cached_count('followers'),
+               cache_size,
+               getattr(user, 'last_refresh', None),
+               label)
+        counters = []
+        for field, attribute in QUERY_COUNTERS.iteritems():
+            counter = user.__dict__.get(attribute) or {}
+            counters.extend((field, key, user.screen_name, count) for key, count in counter.iteritems() if key is not None and count)
+        return row, counters
+
+    def write(self, row, counters):
+        """
+        Replace the row of a user and the rows of its counters
+        """
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', row)
+            self.db.execute('DELETE FROM counters WHERE screen_name = ?', (row[0],))
+            self.db.executemany('INSERT INTO counters VALUES (?, ?, ?, ?)', counters)
+
+    def remove(self, screen_name):
+        """
+        Remove the row of a user that is not in the cache anymore
+        """
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM users WHERE screen_name = ?', (screen_name,))
+            self.db.execute('DELETE FROM counters WHERE screen_name = ?', (screen_name,))
+
+    def users(self):
+        """
+        All the rows, sorted by screen name. Each row is a dict
+        """
+        with self.lock:
+            cursor = self.db.execute('SELECT * FROM users ORDER BY screen_name')
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor]
+
+    def top_counters(self, field, names=None, top=10):
+        """
+        Merge the counter field of the users in names, or of all the users. Returns the total of the counter,
+        and the top values as a list of (value, count, amount of users that have it), the biggest counts first.
+        """
+        with self.lock:
+            selection = ''
+            if names is not None:
+                self.db.execute('CREATE TEMP TABLE IF NOT EXISTS selected (screen_name PRIMARY KEY)')
+                self.db.execute('DELETE FROM selected')
+                self.db.executemany('INSERT OR IGNORE INTO selected VALUES (?)', ((name,) for name in names))
+                selection = ' AND screen_name IN (SELECT screen_name FROM selected)'
+            total = self.db.execute('SELECT SUM(count) FROM counters WHERE field = ?' + selection, (field,)).fetchone()[0] or 0
+            # Each user has each value once, so the rows of a value are its users
+            rows = self.db.execute('SELECT key, SUM(count) AS total, COUNT(*) FROM counters WHERE field = ?' + selection +
+                                   ' GROUP BY key ORDER BY total DESC, key LIMIT ?', (field, top)).fetchall()
+            return total, rows
+
+    def rebuild(self):
+        """
+        Create the rows of all the users in the cache. Only needed once for caches of older versions.
+        Only the record of each user is read. Users still in the old pickle files are read from them but not converted,
+        that is left for --migratecache or the next time the user is loaded.
+        """
+        print('Building the index of the users in the cache.')
+        # The index is of the whole run, not of the user that happened to need it first
+        stats_user = getattr(thread_data, 'stats_user', None)
+        run_stats.set_user(None)
         try:
-            datapath = os.path.expanduser(dirpath + user + '/' + user + '.data')
-            user_object = pickle.load(open(datapath, 'rb'))
-            friends = user_object.friends.keys()
-        except IOError:
+            with run_stats.phase('cache_index'):
+                for name in sorted(listdir(dirpath)):
+                    userpath = dirpath + name + '/' + name
+                    if os.path.exists(userpath + '.db'):
+                        store = UserStore(userpath + '.db')
+                        user = store.load(name)
+                        if user:
+                            self.update(user)
+                        store.db.close()
+                    elif os.path.exists(userpath + '.data'):
+                        self.update(unpickle(open(userpath + '.data', 'rb').read()))
+        finally:
+            run_stats.set_user(stats_user)
+
+def get_manifest():
+    """
+    The index of the users in the cache. It is built the first time it is used
+    """
+    global manifest
+    with manifest_lock:
+        if manifest is None:
+            path = dirpath + MANIFEST_NAME
+            exists = os.path.exists(path)
+            manifest = Manifest(path)
+            if not exists or manifest.missing_counters:
+                manifest.rebuild()
+    return manifest
+
+class ProfileStore():
+    """
+    The profiles of the friends and followers of all the users in the cache, once each, by twitter id and with the time they were downloaded.
+    The store of each user only has the ids of its friends and followers, so popular accounts are downloaded and stored only once.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS profiles (id INTEGER PRIMARY KEY, fetched_at REAL, data BLOB)')
+
+    def get_many(self, ids, max_age=None):
+        """
+        The profiles of the ids that are in the store, as a dict by id. With max_age, only the ones downloaded less than max_age seconds ago
+        """
+        ids = [int(user_id) for user_id in ids]
+        oldest = time.time() - max_age if max_age is not None else None
+        profiles = {}
+        with self.lock:
+            for position in range(0, len(ids), SQLITE_MAX_VARIABLES):
+                chunk = ids[position:position + SQLITE_MAX_VARIABLES]
+                rows = self.db.execute('SELECT id, fetched_at, data FROM profiles WHERE id IN ({})'.format(','.join('?' * len(chunk))), chunk).fetchall()
+                for user_id, fetched_at, data in rows:
+                    if oldest is None or fetched_at >= oldest:
+                        run_stats.add('bytes', 'read', len(data))
+                        profiles[user_id] = unpickle(data)
+        return profiles
+
+    def put_many(self, profiles):
+        """
+        Store profiles just downloaded from twitter
+        """
+        now = time.time()
+        rows = [(profile.id, now, sqlite3.Binary(pickle.dumps(profile, pickle.HIGHEST_PROTOCOL))) for profile in profiles]
+        with self.lock, self.db:
+            self.db.executemany('INSERT OR REPLACE INTO profiles VALUES (?, ?, ?)', rows)
+        run_stats.add('bytes', 'written', sum(len(data) for user_id, fetched_at, data in rows))
+
+    def add_missing(self, profiles):
+        """
+        Store the profiles that are not in the store yet, like the ones of users cached by older versions. Their download time is unknown, so they are old
+        """
+        rows = [(profile.id, 0, sqlite3.Binary(pickle.dumps(profile, pickle.HIGHEST_PROTOCOL))) for profile in profiles]
+        with self.lock, self.db:
+            self.db.executemany('INSERT OR IGNORE INTO profiles VALUES (?, ?, ?)', rows)
+
+def get_profile_store():
+    """
+    The store of the profiles of friends and followers of the cache
+    """
+    global profile_store
+    with profile_store_lock:
+        if profile_store is None:
+            profile_store = ProfileStore(dirpath + PROFILES_NAME)
+    return profile_store
+
+def shared_color(shared):
+    """
+    Color of a node in the graph by the amount of users that share it
+    """
+    if shared <= len(SHARED_COLORS):
+        return SHARED_COLORS[shared - 1]
+    return 'white'
+
+def load_friends_ids(names):
+    """
+    Read from the cache the friends of these users, each user only once.
+    Returns an OrderedDict with a sorted numpy array of the ids of the friends of each user found, and a dict with the screen name of each id.
+    Friends stored without id get a negative id of their own.
+    """
+    friends_ids = OrderedDict()
+    screen_names = {}
+    ids_without_id = {}
+    for name in names:
+        if not user_in_cache(name):
             # This user is not in the cache
             continue
-        for friend in list(set(friends)):
-            try:
-                counter_papa[friend] += 1
-            except KeyError:
-                counter_papa[friend] = 1
-            counter_for_user += 1
-        print('User {} had {} nodes.'.format(user, counter_for_user))
-        counter_for_user = 0
-    # Adding colors
-    if args.debug > 0:
-        print('Putting the color in the nodes.')
-    for node in counter_papa:
-        if counter_papa[node] == 1:
-            color_node[node] = 'LightBlue'
-        elif counter_papa[node] == 2:
-            color_node[node] = 'Red'
-        elif counter_papa[node] == 3:
-            color_node[node] = 'Yellow'
-        elif counter_papa[node] == 4:
-            color_node[node] = 'Blue'
-        elif counter_papa[node] == 5:
-            color_node[node] = 'Orange'
-        elif counter_papa[node] == 6:
-            color_node[node] = 'crimson'
-        elif counter_papa[node] == 7:
-            color_node[node] = 'forestgreen'
-        elif counter_papa[node] == 8:
-            color_node[node] = 'deeppink'
-        elif counter_papa[node] == 9:
-            color_node[node] = 'cadetblue'
-        elif counter_papa[node] == 10:
-            color_node[node] = 'aquamarine'
+        ids = []
+        for friend_name, friend in load_user(name).friends.iteritems():
+            friend_id = friend.id
+            if friend_id is None:
+                friend_id = ids_without_id.setdefault(friend_name, -1 - len(ids_without_id))
+            screen_names[friend_id] = friend_name
+            ids.append(friend_id)
+        friends_ids[name] = numpy.unique(numpy.array(ids, dtype=numpy.int64))
+    return friends_ids, screen_names
+
+def load_neighbour_ids(names, kind):
+    """
+    Read from the cache the complete lists of ids of the friends, the followers or both (kind) of these users.
+    Returns an OrderedDict with a sorted numpy array of ids for each user found.
+    """
+    neighbour_ids = OrderedDict()
+    for name in names:
+        if not user_in_cache(name):
+            print('The user {} is not in our cache database.'.format(name))
+            continue
+        user = load_user(name)
+        arrays = []
+        for neighbours in (('friends', 'followers') if kind == 'both' else (kind,)):
+            ids = getattr(user, neighbours + '_ids')
+            if not len(ids):
+                # Users downloaded before the complete lists were kept only have the ids of their profiles
+                ids = numpy.array([profile.id for profile in getattr(user, neighbours).itervalues() if profile.id is not None], dtype=numpy.int64)
+            arrays.append(numpy.asarray(ids, dtype=numpy.int64))
+        neighbour_ids[name] = numpy.unique(numpy.concatenate(arrays))
+        user._store.db.close()
+    return neighbour_ids
+
+def shared_counts_sparse(neighbour_ids):
+    """
+    Exact amount of ids shared by each pair of users, multiplying the sparse users x ids incidence matrix by its transpose
+    """
+    import scipy.sparse
+    columns = numpy.concatenate(neighbour_ids.values())
+    unique_ids, column_positions = numpy.unique(columns, return_inverse=True)
+    rows = numpy.repeat(numpy.arange(len(neighbour_ids)), [len(ids) for ids in neighbour_ids.values()])
+    incidence = scipy.sparse.csr_matrix((numpy.ones(len(columns), dtype=numpy.int64), (rows, column_positions)), shape=(len(neighbour_ids), len(unique_ids)))
+    return (incidence * incidence.T).toarray()
+
+def minhash_signatures(neighbour_ids, permutations=MINHASH_PERMUTATIONS, seed=0):
+    """
+    MinHash sketch of the ids of each user.
+    The ids are first scrambled with the splitmix64 finalizer, since twitter ids are often consecutive. Then each hash is x * a + b modulo 2**64 with a odd.
+    All the steps are permutations of the 64 bit numbers, so different ids never get the same hash.
+    """
+    random = numpy.random.RandomState(seed)
+    multipliers = random.randint(0, 2 ** 62, size=permutations).astype(numpy.uint64) * numpy.uint64(2) + numpy.uint64(1)
+    increments = random.randint(0, 2 ** 62, size=permutations).astype(numpy.uint64)
+    signatures = numpy.full((len(neighbour_ids), permutations), numpy.iinfo(numpy.uint64).max, dtype=numpy.uint64)
+    for row, ids in enumerate(neighbour_ids.values()):
+        values = ids.astype(numpy.uint64)
+        values = (values ^ (values >> numpy.uint64(30))) * numpy.uint64(0xbf58476d1ce4e5b9)
+        values = (values ^ (values >> numpy.uint64(27))) * numpy.uint64(0x94d049bb133111eb)
+        values = values ^ (values >> numpy.uint64(31))
+        for position in range(0, len(values), MINHASH_CHUNK_SIZE):
+            hashed = values[position:position + MINHASH_CHUNK_SIZE, None] * multipliers + increments
+            signatures[row] = numpy.minimum(signatures[row], hashed.min(axis=0))
+    return signatures
+
+def similarity_matrices(neighbour_ids):
+    """
+    Pairwise shared ids, Jaccard index and overlap coefficient of the users, as matrices in the order of neighbour_ids.
+    The shared ids are exact with scipy. Without it they are estimated from MinHash sketches.
+    Returns the three matrices and the method used.
+    """
+    sizes = numpy.array([len(ids) for ids in neighbour_ids.values()], dtype=numpy.int64)
+    try:
+        shared = shared_counts_sparse(neighbour_ids)
+        method = 'exact'
+    except ImportError:
+        signatures = minhash_signatures(neighbour_ids)
+        estimated = numpy.empty((len(sizes), len(sizes)))
+        for row in range(len(sizes)):
+            estimated[row] = (signatures == signatures[row]).mean(axis=1)
+        # From J = shared / (a + b - shared)
+        shared = numpy.rint(estimated * (sizes[:, None] + sizes[None, :]) / (1 + estimated)).astype(numpy.int64)
+        method = 'minhash'
+    union = sizes[:, None] + sizes[None, :] - shared
+    smaller = numpy.minimum(sizes[:, None], sizes[None, :])
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        jaccard = numpy.where(union > 0, shared / union.astype(float), 0.0)
+        overlap = numpy.where(smaller > 0, shared / smaller.astype(float), 0.0)
+    return shared, jaccard, overlap, method
+
+def compare_users(names, kind, top, matrix_path=None):
+    """
+    Print the top most similar users of each user by their friends, followers or both, and optionally write the matrices.
+    A path ending in .csv gets one line per pair of users that share ids. Other paths get a numpy .npz file with the names, sizes and the three matrices.
+    """
+    neighbour_ids = load_neighbour_ids(names, kind)
+    if len(neighbour_ids) < 2:
+        print('At least two users in the cache are needed to compare them.')
+        return
+    shared, jaccard, overlap, method = similarity_matrices(neighbour_ids)
+    names = neighbour_ids.keys()
+    print('[+] Similarity of {} users by their {} ({}).'.format(len(names), kind, method))
+    for row, name in enumerate(names):
+        print('{} ({} {}):'.format(name, len(neighbour_ids[name]), kind))
+        # The most similar first, ties by name. The user itself is not compared
+        others = sorted((column for column in range(len(names)) if column != row), key=lambda column: (-jaccard[row, column], names[column]))
+        for column in others[:top]:
+            print('    {:20} Jaccard {:.4f} Overlap {:.4f} Shared {}'.format(names[column], jaccard[row, column], overlap[row, column], shared[row, column]))
+    if matrix_path:
+        if matrix_path.endswith('.csv'):
+            with open(matrix_path, 'wb') as output:
+                output.write('user_a,user_b,shared,jaccard,overlap\n')
+                for row, column in zip(*numpy.nonzero(numpy.triu(shared, 1))):
+                    output.write('{},{},{},{:.6f},{:.6f}\n'.format(names[row], names[column], shared[row, column], jaccard[row, column], overlap[row, column]))
+        else:
+            with open(matrix_path, 'wb') as output:
+                numpy.savez_compressed(output, names=numpy.array(names), sizes=numpy.array([len(ids) for ids in neighbour_ids.values()]), shared=shared, jaccard=jaccard, overlap=overlap)
+        print('Matrices written to {}'.format(matrix_path))
+
+class GraphWriter(object):
+    """
+    Writes a graph to a file while it is built, one node or edge at a time, so the memory used does not grow with the graph.
+    All the nodes are added before the first edge.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.nodes = 0
+        self.edges = 0
+        self.output = io.open(path, 'w', encoding='utf-8')
+        self.start()
+
+    def start(self):
+        pass
+
+    def add_node(self, name, group, color, shared):
+        """ group is First for the users and Second for their friends, shared is the amount of users that follow the node """
+        self.nodes += 1
+        self.write_node(name, group, color, shared)
+
+    def add_edge(self, source, target):
+        self.edges += 1
+        self.write_edge(source, target)
+
+    def write_node(self, name, group, color, shared):
+        pass
+
+    def write_edge(self, source, target):
+        pass
+
+    def end(self):
+        pass
+
+    def close(self):
+        self.end()
+        self.output.close()
+
+class DotWriter(GraphWriter):
+    """ Graphviz DOT, with the same style pydot gave the nodes """
+    def start(self):
+        self.output.write('graph G {\nresolution=300;\nfontsize=21;\n')
+
+    def quote(self, name):
+        return '"{}"'.format(name.replace('\\', '\\\\').replace('"', '\\"'))
+
+    def write_node(self, name, group, color, shared):
+        if group == 'First':
+            self.output.write('{} [shape=rectangle, group=First, style=filled, fontsize=36, color=red, fontname="Times-Bold", fontcolor=yellow, fillcolor={}];\n'.format(self.quote(name), color))
         else:
-            color_node[node] = 'white'
+            self.output.write('{} [fontcolor=black, group=Second, style=filled, fillcolor={}];\n'.format(self.quote(name), color))
+
+    def write_edge(self, source, target):
+        self.output.write('{} -- {};\n'.format(self.quote(source), self.quote(target)))
+
+    def end(self):
+        self.output.write('}\n')
+
+class GraphMLWriter(GraphWriter):
+    """ GraphML, with the group, the color and the amount of users that share each node as data """
+    def start(self):
+        self.output.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                          '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n'
+                          '  <key id="group" for="node" attr.name="group" attr.type="string"/>\n'
+                          '  <key id="color" for="node" attr.name="color" attr.type="string"/>\n'
+                          '  <key id="shared" for="node" attr.name="shared" attr.type="int"/>\n'
+                          '  <graph id="G" edgedefault="undirected">\n')
+
+    def write_node(self, name, group, color, shared):
+        self.output.write('    <node id={}><data key="group">{}</data><data key="color">{}</data><data key="shared">{}</data></node>\n'.format(quoteattr(name), group, color, shared))
+
+    def write_edge(self, source, target):
+        self.output.write('    <edge source={} target={}/>\n'.format(quoteattr(source), quoteattr(target)))
+
+    def end(self):
+        self.output.write('  </graph>\n</graphml>\n')
+
+class GEXFWriter(GraphWriter):
+    """ GEXF for Gephi, with the colors of the nodes as viz colors """
+    def start(self):
+        self.output.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                          '<gexf xmlns="http://www.gexf.net/1.2draft" xmlns:viz="http://www.gexf.net/1.2draft/viz" version="1.2">\n'
+                          '  <graph defaultedgetype="undirected">\n'
+                          '    <attributes class="node">\n'
+                          '      <attribute id="group" title="group" type="string"/>\n'
+                          '      <attribute id="shared" title="shared" type="integer"/>\n'
+                          '    </attributes>\n'
+                          '    <nodes>\n')
+
+    def write_node(self, name, group, color, shared):
+        self.output.write('      <node id={0} label={0}><attvalues><attvalue for="group" value="{1}"/><attvalue for="shared" value="{2}"/></attvalues><viz:color r="{3}" g="{4}" b="{5}"/></node>\n'.format(quoteattr(name), group, shared, *GEXF_COLORS[color]))
+
+    def write_edge(self, source, target):
+        if self.edges == 1:
+            self.output.write('    </nodes>\n    <edges>\n')
+        self.output.write('      <edge id="{}" source={} target={}/>\n'.format(self.edges, quoteattr(source), quoteattr(target)))
+
+    def end(self):
+        if not self.edges:
+            self.output.write('    </nodes>\n    <edges>\n')
+        self.output.write('    </edges>\n  </graph>\n</gexf>\n')
+
+class EdgeListWriter(GraphWriter):
+    """ One edge per line, the user and the friend separated by a tab. The nodes are only counted """
+    def write_edge(self, source, target):
+        self.output.write('{}\t{}\n'.format(source, target))
+
+# Writer of each format of the graph, by name. The name is also the extension of the file
+GRAPH_WRITERS = OrderedDict([('dot', DotWriter), ('graphml', GraphMLWriter), ('gexf', GEXFWriter), ('edgelist', EdgeListWriter)])
+
+def render_graph(path, program):
+    """
+    Render a DOT file as a PNG next to it with a Graphviz layout program (dot, sfdp, neato, fdp, ...).
+    """
+    png_path = os.path.splitext(path)[0] + '.png'
+    print('Rendering {} with {}'.format(png_path, program))
+    try:
+        returncode = subprocess.call([program, '-Tpng', '-o', png_path, path])
+    except OSError:
+        print('The layout program {} is not installed. Install Graphviz or render {} later.'.format(program, path))
+        return
+    if returncode:
+        print('{} failed with status {}'.format(program, returncode))
+
+def plot_users(users, dirpath, output=None, graphformat=None, render=None):
+    """
+    Read the friends of these users from the cache and write a graph of them and their shared friends.
+    The graph is written in graphformat (by default the one of the extension of output, or dot) to output (by default graph.<format>).
+    With render, the DOT graph is also rendered as a PNG by that Graphviz program.
+    """
+    if graphformat is None:
+        extension = os.path.splitext(output)[1][1:] if output else ''
+        graphformat = extension if extension in GRAPH_WRITERS else 'dot'
+    if output is None:
+        output = 'graph.' + graphformat
+    if render and graphformat != 'dot':
+        print('Only the dot format can be rendered. Use --graphformat dot to render the graph.')
+        render = None
+    print('Plotting a unique graph for all users')
+    friends_ids, screen_names = load_friends_ids(users.split(','))
+    for user in friends_ids:
+        print('User {} had {} nodes.'.format(user, len(friends_ids[user])))
+    # Count how many users follow each friend. These are the sums of the columns of the users x friends incidence matrix
+    if friends_ids:
+        all_friends, shared_counts = numpy.unique(numpy.concatenate(friends_ids.values()), return_counts=True)
+    else:
+        all_friends, shared_counts = numpy.array([], dtype=numpy.int64), numpy.array([], dtype=numpy.int64)
     # Delete the secondary nodes that had less than certain amount of edges to them
     try:
         minnodes = args.minnumnsharednodes
     except AttributeError:
         minnodes = 0
-    count_reviewed = 0
-    for user in users.split(','):
-        if args.debug > 1:
-            print('User: {}'.format(user))
-        # read their friends
-        try:
-            datapath = os.path.expanduser(dirpath + user + '/' + user + '.data')
-            user_object = pickle.load(open(datapath, 'rb'))
-            friends = user_object.friends.keys()
-        except IOError:
-            # This user is not in the cache
-            continue
+    writer = GRAPH_WRITERS[graphformat](output)
+    try:
         # Add the main nodes
-        if pygraph.get_node(user) == []:
-            node = pydot.Node(user,fontcolor='black',shape='rectangle')
-            node.set_group('First')
-            node.set_style('filled')
-            node.set_fontsize('36')
-            node.set_color('red')
-            node.set_fontname('Times-Bold')
-            node.set_fontcolor('yellow')
-            node.set_fillcolor('black')
-            pygraph.add_node(node)
-            count_reviewed += 1
+        for user in friends_ids:
             if args.debug > 1:
-                print('Add node: {} is {}'.format(node.get_name(), count_reviewed))
-        for friend in list(set(friends)):
+                print('User: {}'.format(user))
+            writer.add_node(user, 'First', 'black', len(friends_ids))
             if args.debug > 1:
-                print('\tEvaluating Friend: {}, has {} links'.format(friend, counter_papa[friend]))
-            if counter_papa[friend] > minnodes:
-                # Add the secondary nodes
-                if pygraph.get_node(friend) == []:
-                    node = pydot.Node(friend,fontcolor='black')
-                    node.set_group('Second')
-                    node.set_style('filled')
-                    node.set_fillcolor(color_node[node.get_name().replace('"','')])
-                    pygraph.add_node(node)
-                    count_reviewed += 1
-                    if args.debug > 1:
-                        print('\t\tAdd node: {} is {}'.format(node.get_name(), count_reviewed))
-                # Make the edge
-                edge = pydot.Edge(user, friend)
-                pygraph.add_edge(edge)
-    print('Total nodes processed: {}'.format(count_reviewed))
-    nodes = pygraph.get_node_list()
-    print('Amount of nodes in the graph: {}'.format(len(nodes)))
+                print('Add node: {} is {}'.format(user, writer.nodes))
+        # Add the secondary nodes. Each friend is unique in all_friends, so there is no need to remember which nodes are in the graph
+        selected = shared_counts > minnodes
+        for friend_id, shared in zip(all_friends[selected], shared_counts[selected]):
+            friend = screen_names[friend_id]
+            if friend in friends_ids:
+                # Friend of another user, already added as a main node
+                continue
+            writer.add_node(friend, 'Second', shared_color(shared), shared)
+            if args.debug > 1:
+                print('\t\tAdd node: {} is {}, has {} links'.format(friend, writer.nodes, shared))
+        # Make the edges. The amount of users that share each friend of this user selects them
+        for user in friends_ids:
+            friends_shared = shared_counts[numpy.searchsorted(all_friends, friends_ids[user])]
+            for friend_id in friends_ids[user][friends_shared > minnodes]:
+                writer.add_edge(user, screen_names[friend_id])
+    finally:
+        writer.close()
+    print('Total nodes processed: {}'.format(writer.nodes))
+    print('Amount of edges in the graph: {}'.format(writer.edges))
+    print('Graph written to {}'.format(output))
     if args.debug > 0:
         print ('Colors in the graph:')
         print ('Share 1 follower: LightBlue')
@@ -962,13 +2480,232 @@ def plot_users(users, dirpath):
         print ('Share 9 followers: Cadet Blue')
         print ('Share 10 followers: Aquamarine')
         print ('Share >10 followers: White')
-    pygraph.write_png('graph.png')
-    pygraph.write_dot('graph.dot')
+    if render:
+        render_graph(output, render)
+
+
+def print_followers_from_manifest(names):
+    """
+    Print the amount of followers of the users as stored in the index of the cache, without loading them. Same format as User.print_followers()
+    """
+    now = datetime.datetime.now()
+    for row in get_manifest().users():
+        if names is None or row['screen_name'] in names:
+            print('{},{},{}'.format(now, row['screen_name'], row['followers_count']))
+
+def query_counters(names, fields, label=None, top=10):
+    """
+    Print the top values of the counters fields (hashtags, domains, ...) merged for the users in names, or all the users in the cache,
+    with their total count and the amount of users that have them. With label, only the users with that category in their label are used.
+    Only the index of the cache is read, not the tweets.
+    """
+    rows = get_manifest().users()
+    if names is not None:
+        names = set(names)
+        rows = [row for row in rows if row['screen_name'] in names]
+    if label:
+        # The label is stored as label_what:label_how, and label_how is a comma separated list of categories
+        rows = [row for row in rows if row['label'] and label in row['label'].split(':', 1)[-1].split(',')]
+    selected = [row['screen_name'] for row in rows]
+    print('Querying {} users.'.format(len(selected)))
+    for field in fields:
+        total, values = get_manifest().top_counters(field, None if names is None and not label else selected, top)
+        if not values:
+            continue
+        print('[+] Top {} of the users (Total {} in this category).'.format(field, total))
+        max_len_key = max(len(value) for value, count, users in values)
+        for value, count, users in values:
+            print(('- \033[1m{:<%d}\033[0m {:>8} {:<6} in {} users' % max_len_key).format(value, count, '({}%)'.format(count * 100 // total), users))
+        print('')
+
+def json_default(value):
+    """ Dates of the profiles are written as ISO 8601 """
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+def write_jsonl(output, record):
+    """ Write one record as a line of json """
+    output.write(json.dumps(record, default=json_default) + '\n')
+
+def export_jsonl(names, path):
+    """
+    Export the users in the cache as JSON Lines to the file in path, or to the standard output if path is -.
+    The users are read from the cache one at a time.
+    """
+    output = sys.stdout if path == '-' else open(path, 'wb')
+    try:
+        for name in names:
+            if not user_in_cache(name):
+                sys.stderr.write('The user {} is not in our cache database.\n'.format(name))
+                continue
+            user = load_user(name)
+            user.export_jsonl(output)
+            user._store.db.close()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+def read_watchlist(path):
+    """
+    Screen names of a watch list file, one per line. Empty lines and lines starting with # are skipped
+    """
+    with open(path) as watchlist:
+        return [line.strip() for line in watchlist if line.strip() and not line.strip().startswith('#')]
+
+def timeseries_path(name):
+    return dirpath + TIMESERIES_DIR + '/' + name + '.ts'
+
+def read_timeseries(name):
+    """
+    The time series of a monitored user as a numpy array of records, with one column per field. None if it was never monitored
+    """
+    path = timeseries_path(name)
+    if not os.path.exists(path):
+        return None
+    return numpy.fromfile(path, dtype=numpy.dtype(TIMESERIES_FIELDS))
+
+def lookup_counts(names):
+    """
+    Ask twitter for the profiles of up to LOOKUP_BATCH_SIZE screen names in one users/lookup call.
+    Returns a list of (name as given, tweepy user). Suspended or deleted accounts are not returned.
+    """
+    try:
+        profiles = rate_limiter.call('users/lookup', 'lookup_users', screen_names=names)
+    except tweepy.error.TweepError as e:
+        try:
+            code = e[0][0]['code']
+        except (TypeError, IndexError, KeyError):
+            code = None
+        if code != 17: # No user matches for specified terms
+            print("[\033[91m!\033[0m] Twitter error looking up {} users: {}".format(len(names), e))
+        return []
+    # Twitter may answer the names with other capitalization
+    given_names = {name.lower(): name for name in names}
+    return [(given_names.get(profile.screen_name.lower(), profile.screen_name), profile) for profile in profiles]
+
+def monitor_users(names, auth):
+    """
+    Refresh the followers, friends, tweets and listed counts of the users and append them to their time series.
+    The users are asked to twitter in batches of LOOKUP_BATCH_SIZE, args.workers batches at the same time.
+    Each user is printed like -F does.
+    """
+    if not os.path.exists(dirpath + TIMESERIES_DIR):
+        os.makedirs(dirpath + TIMESERIES_DIR)
+    dtype = numpy.dtype(TIMESERIES_FIELDS)
+    batches = [names[position:position + LOOKUP_BATCH_SIZE] for position in range(0, len(names), LOOKUP_BATCH_SIZE)]
+    pool = None
+    if args.workers > 1:
+        pool = ThreadPool(args.workers, initializer=init_worker_api, initargs=(auth,))
+        answers = pool.imap(lookup_counts, batches)
+    else:
+        answers = (lookup_counts(batch) for batch in batches)
+    found = 0
+    try:
+        for answer in answers:
+            now = datetime.datetime.now()
+            # The series keep seconds since the epoch, like time.time() that --growth compares with
+            timestamp = int(time.time())
+            for name, profile in answer:
+                record = numpy.array([(timestamp, profile.followers_count, profile.friends_count, profile.statuses_count, profile.listed_count)], dtype=dtype)
+                with open(timeseries_path(name), 'ab') as timeseries:
+                    timeseries.write(record.tobytes())
+                print('{},{},{}'.format(now, name, profile.followers_count))
+                found += 1
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    if found < len(names):
+        sys.stderr.write('{} of the {} users were not found in twitter.\n'.format(len(names) - found, len(names)))
+
+def print_growth(names, days):
+    """
+    Print how the counts of the monitored users changed in the last days, as csv sorted by the change of followers.
+    The change is from the last refresh before the period, or the first one in it, to the last refresh.
+    """
+    since = time.time() - days * 86400
+    rows = []
+    for name in names:
+        series = read_timeseries(name)
+        if series is None or not len(series):
+            continue
+        # The records are in the order they were added, so the times are sorted
+        position = max(numpy.searchsorted(series['time'], since, side='right') - 1, 0)
+        rows.append((name, series[position], series[-1]))
+    rows.sort(key=lambda row: (-(int(row[2]['followers_count']) - int(row[1]['followers_count'])), row[0]))
+    print('screen_name,from,to,followers_count,followers_change,friends_change,statuses_change,listed_change')
+    for name, first, last in rows:
+        print('{},{},{},{},{},{},{},{}'.format(name, datetime.datetime.utcfromtimestamp(first['time']), datetime.datetime.utcfromtimestamp(last['time']), last['followers_count'],
+              last['followers_count'] - first['followers_count'], last['friends_count'] - first['friends_count'],
+              last['statuses_count'] - first['statuses_count'], last['listed_count'] - first['listed_count']))
+
+def compute_churn(store, kind, first, last):
+    """
+    Compare two snapshots of the friends or followers, given by their position in the list of snapshots (negative from the end).
+    Returns a dict with the snapshots compared and the new, lost and returning ids as sorted numpy arrays.
+    Returning ids are new ids that were in some snapshot before the first one. None if there are not enough snapshots.
+    """
+    snapshots = store.list_snapshots(kind)
+    try:
+        first_snapshot = snapshots[first]
+        last_snapshot = snapshots[last]
+    except IndexError:
+        return None
+    old_ids = store.load_snapshot(first_snapshot[0])
+    new_ids = store.load_snapshot(last_snapshot[0])
+    # The snapshots are sorted and without repetitions, so the set operations do not need to sort them again
+    new = numpy.setdiff1d(new_ids, old_ids, assume_unique=True)
+    lost = numpy.setdiff1d(old_ids, new_ids, assume_unique=True)
+    # Look for the new ids in the snapshots before the first one, with a binary search since they are sorted. The ones found are not searched again
+    candidates = new
+    found = []
+    for rowid, taken_at, amount in reversed(snapshots[:snapshots.index(first_snapshot)]):
+        if not len(candidates):
+            break
+        snapshot = store.load_snapshot(rowid)
+        if not len(snapshot):
+            continue
+        positions = numpy.minimum(numpy.searchsorted(snapshot, candidates), len(snapshot) - 1)
+        in_snapshot = snapshot[positions] == candidates
+        found.append(candidates[in_snapshot])
+        candidates = candidates[~in_snapshot]
+    returning = numpy.sort(numpy.concatenate(found)) if found else numpy.array([], dtype=numpy.int64)
+    return {'from': first_snapshot, 'to': last_snapshot, 'new': new, 'lost': lost, 'returning': returning}
 
+def print_churn(names, snapshots):
+    """
+    Print the new, lost and returning friends and followers of the users between two snapshots, and the total of all the users.
+    snapshots is 'first:last', the positions of the snapshots to compare. Negative positions count from the last one.
+    """
+    first, last = [int(position) for position in snapshots.split(':')]
+    totals = {kind: collections.Counter() for kind in ('friends', 'followers')}
+    print('{:20} {:9} {:19} {:19} {:>9} {:>9} {:>8} {:>8} {:>9}'.format('User', 'Kind', 'From', 'To', 'Before', 'After', 'New', 'Lost', 'Returning'))
+    for name in names:
+        if not user_in_cache(name):
+            print('The user {} is not in our cache database.'.format(name))
+            continue
+        store = load_user(name)._store
+        for kind in ('friends', 'followers'):
+            churn = compute_churn(store, kind, first, last)
+            if churn is None:
+                print('{:20} {:9} Not enough snapshots'.format(name, kind))
+                continue
+            counts = {'before': churn['from'][2], 'after': churn['to'][2], 'new': len(churn['new']), 'lost': len(churn['lost']), 'returning': len(churn['returning'])}
+            totals[kind].update(counts)
+            print('{:20} {:9} {:19} {:19} {before:9} {after:9} {new:8} {lost:8} {returning:9}'.format(name, kind, datetime.datetime.fromtimestamp(churn['from'][1]).strftime('%Y-%m-%d %H:%M:%S'),
+                  datetime.datetime.fromtimestamp(churn['to'][1]).strftime('%Y-%m-%d %H:%M:%S'), **counts))
+            if args.debug > 0:
+                for change in ('new', 'lost', 'returning'):
+                    print('    {} {}: {}'.format(change, kind, ','.join(str(user_id) for user_id in churn[change])))
+        store.db.close()
+    for kind in ('friends', 'followers'):
+        counts = totals[kind]
+        print('{:20} {:9} {:19} {:19} {:9} {:9} {:8} {:8} {:9}'.format('TOTAL', kind, '', '', counts['before'], counts['after'], counts['new'], counts['lost'], counts['returning']))
 
 def list_users_in_db():
     # List the cache
-    list_of_users = os.listdir(dirpath)
+    list_of_users = [row['screen_name'] for row in get_manifest().users()]
     composite_list = [list_of_users[x:x+10] for x in range(0, len(list_of_users),10)]
     for list in composite_list:
         for user in list:
@@ -976,39 +2713,279 @@ def list_users_in_db():
         print('')
 
 
+def parse_arguments(argv=None):
+    """
+    Parse the command line parameters. Without argv, the ones of the program are used
+    """
+    parser = argparse.ArgumentParser(description="Twitter Profiler version %s. Author: Sebastian Garcia (eldraco@gmail.com, @eldracote). Based on original code of @x0rz." % __version__, usage='%(prog)s -n <screen_name> [options]')
+    parser.add_argument('-n', '--names', required=False, metavar="screen_names", help='Target screen_names. Can be a comma separated list of names for multiple comparisons and multiple download of data.')
+    parser.add_argument('-l', '--limit', type=int, default=1000, help='Limit the number of tweets to retreive (default=1000)')
+    parser.add_argument('--no-timezone', action='store_true', help='Removes the timezone auto-adjustment (default is UTC)')
+    parser.add_argument('--utc-offset', type=int, help='Manually apply a timezone offset (in seconds)')
+    parser.add_argument('-s', '--nosummary', action='store_true', default=False, help='Do not show the summary of the user.')
+    parser.add_argument('-F', '--quickfollowers', action='store_true', help='Print only a very short summary about the number of followers for the users. Useful to run with cron and store the results. With -o the numbers are read from the index of the cache without loading the users.')
+    parser.add_argument('-c', '--color', action='store_true', help='Do not  Use colors when printing', default=True)
+    parser.add_argument('-N', '--numfriends', action='store', help='Max amount of friends to retrieve. Defaults to 200. Use -1 to retrieve all of them. Warning! this can take long, since twitter limits 700 friends requests every 15mins approx.', default=200, type=int)
+    parser.add_argument('-O', '--numfollowers', action='store', help='Max amount of followers to retrieve. Defaults to 200. Use -1 to retrieve all of them. Warning! this can take long, since twitter limits 700 followers requests every 15mins approx.', default=200, type=int)
+    parser.add_argument('-o', '--offline', action='store_true', default=False, help='Use the offline data stored in cache for all the actions. Do not retrieve them from Twitter (use after you retrieved it at least once).')
+    parser.add_argument('-d', '--debug', action='store', type=int, default=0, help='Debug level.')
+    parser.add_argument('-t', '--maxtweets', action='store', type=int, default=1000, help='Maximum amount of tweets to download for analysis per user.')
+    parser.add_argument('-B', '--backfill', action='store_true', help='Download the tweets older than the oldest tweet in the cache, instead of the newest ones. Twitter only gives the last 3,200 tweets of a user.', default=False)
+    parser.add_argument('-x', '--redocache', action='store_true', help='Delete all the cache data for this user and download again. Useful if the cache becomes corrupted.')
+    parser.add_argument('-i', '--listcacheusers', action='store_true', help='List the users in the cache.')
+    parser.add_argument('-g', '--graphusers', action='store_true', help='Get the list of users specified with -n, read their _offline_ data, and create a unique graph for all their shared friends. The graph is written as it is built to --graphoutput, in --graphformat. Use --render to also get a PNG image, or open the graph in Gephi or Graphviz (e.g. sfdp -Tpng -o graph2.png graph.dot). Use -m to limit the minimum amount of shared connections you want in the graph.')
+    parser.add_argument('--graphformat', action='store', choices=list(GRAPH_WRITERS), help='Together with -g, the format of the graph: dot, graphml, gexf (for Gephi) or edgelist (one tab separated edge per line). Defaults to the extension of --graphoutput, or dot.', default=None)
+    parser.add_argument('--graphoutput', action='store', metavar='PATH', help='Together with -g, the file to write the graph to. Defaults to graph.<format> in the current folder.', default=None)
+    parser.add_argument('--render', action='store', metavar='PROGRAM', help='Together with -g and the dot format, render the graph as a PNG next to it with this Graphviz layout program (dot, sfdp, neato, fdp, ...). sfdp is much faster for large graphs. By default the graph is not rendered.', default=None)
+    parser.add_argument('-m', '--minnumnsharednodes', action='store', help='Together with -g for making a graph, this options selects the minimum amount of shared friends to put in the graph as nodes. Defaults to 2', default=2, type=int)
+    parser.add_argument('-S', '--sentiment', action='store_true', help='Analyze the sentiment of all the tweets. Each tweet is scored only once and its score is stored in the cache.', default=False)
+    parser.add_argument('-L', '--label', action='store', required=False, type=str, help='Label to assign to this Twitter user. For humans use human, for bots use bot, for trolls use troll. ', default=False)
+    parser.add_argument('-e', '--export', action='store_true', help='Export the data of this user in his folder called <username>-data.json', default=False)
+    parser.add_argument('-J', '--jsonl', action='store', metavar='path', help='Export the users given with -n, or all the users in the cache with -a, from the cache to a JSON Lines file, one record per line for the profile, each tweet, each friend and follower and the pages of ids. Use - for the standard output. The users are not downloaded and do not need a label.')
+    parser.add_argument('-M', '--monitor', action='store_true', help='Refresh the followers, friends, tweets and listed counts of the users given with -n, -a or --watchlist and add them to their time series in the cache. Twitter is asked for 100 users in each call, -w calls at the same time. Prints the followers like -F.', default=False)
+    parser.add_argument('--watchlist', action='store', metavar='path', help='File with the screen names to use with -M or --growth, one per line.')
+    parser.add_argument('--growth', action='store', type=float, metavar='days', help='Print the change of the counts of the users monitored with -M in the last days, as csv. Use -n, -a or --watchlist to select the users. Does not connect to twitter.')
+    parser.add_argument('--churn', action='store', nargs='?', const='-2:-1', metavar='first:last', help='Print the new, lost and returning friends and followers of the users given with -n, or all with -a, between two snapshots of their ids. A snapshot is kept each time the complete list of ids is downloaded and it changed. first:last are the positions of the snapshots, negative from the last one. Defaults to -2:-1, the last two. With -d 1 the ids are printed. Does not connect to twitter.')
+    parser.add_argument('--compare', action='store', choices=['friends', 'followers', 'both'], help='Compare the users given with -n, or all with -a, by their friends, followers or both together. Prints the most similar users of each one by Jaccard index, with the overlap coefficient and the shared accounts. Exact if scipy is installed, estimated with MinHash if not. Does not connect to twitter.')
+    parser.add_argument('--top', action='store', type=int, default=5, help='Amount of most similar users to print for each user with --compare, or of top values of each counter with --query. Defaults to 5.')
+    parser.add_argument('-Q', '--query', action='store', metavar='counters', help='Print the top values of these comma separated counters merged for the users given with -n, or all the users in the cache: ' + ', '.join(QUERY_COUNTERS) + '. With the count of each value and the amount of users that have it. Only the index of the cache is read, so it is fast for many users. Does not connect to twitter.')
+    parser.add_argument('--querylabel', action='store', metavar='category', help='With --query, use only the users with this category in their label (e.g. troll, bot, human).')
+    parser.add_argument('--matrix', action='store', metavar='path', help='With --compare, write the matrices of the comparison. A .csv file has one line per pair of users with shared accounts, other names get a numpy .npz file.')
+    parser.add_argument('-a', '--all', action='store_true', help='Apply the selected actions to all the users in the database.', default=False)
+    parser.add_argument('-w', '--workers', action='store', type=int, default=1, help='Amount of users to download at the same time. All of them share the twitter rate limits, and the summaries are printed in the order of the names. Defaults to 1.')
+    parser.add_argument('-C', '--connections', action='store', type=int, default=1, help='Calls to twitter at the same time for each user, over a pool of keep-alive connections. The profiles of the friends and followers are asked in this many batches at the same time, as long as the rate limit of users/lookup has budget. With more than 1, our own HTTP client is used instead of tweepy. Defaults to 1.')
+    parser.add_argument('--apiurl', action='store', default=API_URL, help='Root URL of the twitter API. Point it to a local server that stands in for twitter to test the downloads. Uses our own HTTP client. Defaults to ' + API_URL)
+    parser.add_argument('-P', '--processes', action='store', type=int, default=1, help='Together with -o, analyze this amount of users at the same time, each in its own process. The summaries are printed in the order of the names. Not used with -S. Defaults to 1.')
+    parser.add_argument('--rebuildstats', action='store_true', help='Compute the statistics of the tweets again from all the tweets in the cache. By default only the new tweets are added to the stored statistics.', default=False)
+    parser.add_argument('--migratecache', action='store_true', help='Convert all the users in the cache from the old pickle files to the new store and exit. Users are also converted automatically the first time they are used.', default=False)
+    parser.add_argument('--profilettl', action='store', type=float, default=168, help='Hours that the profiles of friends and followers in the cache are used before downloading them again. All the users of the cache share them. Defaults to 168 (a week).')
+    parser.add_argument('--idsttl', action='store', type=float, default=24, help='Hours that the complete list of ids of the friends or followers of a user is used to download their next profiles before paging it again from twitter. It is also paged again when all its profiles are downloaded. Defaults to 24.')
+    parser.add_argument('--stats', action='store', choices=['json', 'table'], help='At the end, print the time of each phase, the calls to twitter, the time waiting for the rate limits, the bytes read and written in the cache and the cache hits, per user and in total. As json or as a table.')
+    return parser.parse_args(argv)
+
+def fetch_user(name):
+    """
+    Load a user from the cache and, if we are not offline, download its new data from twitter.
+    Returns the user and if it exists.
+    Can run in a worker thread, so it does not print the summary.
+    """
+    print('\nProcessing the name {}.'.format(name))
+    run_stats.set_user(name)
+    user = None
+    exists = False
+    try:
+        # Should we delete the cache for this user?
+        if args.redocache:
+            print 'Deleteing all the cache from this user and starting again.'
+            shutil.rmtree(dirpath + name, ignore_errors=True)
+
+        # Create our folder if we need it, and the user object
+        try:
+            os.makedirs(dirpath + name)
+            # It does not exist yet
+            if args.debug > 1:
+                print('Folders created in {}'.format(dirpath + name))
+            user = User(name)
+        except OSError:
+            # Already exists
+            exists = True
+            if args.debug > 1:
+                print('The user {} exists, loading its data.'.format(name))
+            # Load what we know from this user
+            # We always load the cache, if we are offline or not.
+            with run_stats.phase('cache_load'):
+                user = load_user(name)
+        user.dirpath = dirpath
+
+        # If offline, load the file only, if online, get more data
+        # Get basic info from twitter if we are not offline. If offline, get the cache
+        if not args.offline:
+            if args.debug > 1:
+                print('Getting basic twitter info.')
+            #
+            # Here is where most of the stuff happens, donwloading data from twitter api
+            # Get basic info
+            with run_stats.phase('get_twitter_info'):
+                exists = user.get_twitter_info()
+            if exists and not user.protected:
+                # Get friends
+                with run_stats.phase('get_friends'):
+                    user.get_friends()
+                # Get followers
+                with run_stats.phase('get_followers'):
+                    user.get_followers()
+                # Get twitts
+                with run_stats.phase('get_tweets'):
+                    user.get_tweets()
+    except KeyboardInterrupt:
+        # Print Summary of detections in the last Time Window
+        print('Keyboard Interrupt. Storing the user')
+        if user:
+            store_user(user)
+        exists = False
+    except tweepy.error.TweepError as e:
+        # Do not stop the other users
+        print("[\033[91m!\033[0m] Twitter error with {}: {}".format(name, e))
+        try:
+            if e[0][0]['code'] == 50:
+                # user not found
+                shutil.rmtree(dirpath + name, ignore_errors=True)
+        except TypeError:
+            if e == 'Not authorized':
+                print('The account of this user is protected, we can not get its friends.')
+        exists = False
+    return user, exists
+
+def report_user(user, exists):
+    """
+    After downloading the data of a user (or not if offline) do things with it, and store it
+    """
+    if not exists:
+        return
+    run_stats.set_user(user.screen_name)
+    try:
+        # Add the label
+        if args.label:
+            # Adding the label can fail because of the format
+            if user.add_label(args.label) == False:
+                sys.exit(-1)
+        # Only show the amount of friends
+        if args.quickfollowers:
+            user.print_followers()
+        # The statistics of the tweets are stored with the user and in the index of the cache that -Q reads, so they are updated also without the summary
+        with run_stats.phase('process'):
+            user.process_tweets()
+        if args.sentiment:
+            with run_stats.phase('analyze_sentiments'):
+                user.analyze_sentiments()
+        # Analyze features of the profile
+        with run_stats.phase('analyze_features'):
+            user.analyze_features()
+        # Option by default, print a Summary of the account, including the friends
+        if not args.nosummary:
+            # To protect from offline asking of unknown users
+            if args.offline and not user.user_info:
+                print('The user {} is not in our cache database.'.format(user.screen_name))
+                sys.exit(0)
+            with run_stats.phase('process'):
+                user.process_friends()
+                user.process_followers()
+            with run_stats.phase('print_summary'):
+                user.print_summary(process=False)
+        # Export the data to disk
+        if args.export:
+            with run_stats.phase('export'):
+                user.export()
+        # Always Store this user in our disk cache
+        store_user(user)
+    except KeyboardInterrupt:
+        # Print Summary of detections in the last Time Window
+        print('Keyboard Interrupt. Storing the user')
+        store_user(user)
+
+def init_worker_api(auth):
+    """
+    Each worker thread has its own connection to twitter, so the answers of the calls of different users are not mixed.
+    Our own HTTP client is shared, since it keeps the answer of each thread apart. Offline there is no auth and no connection.
+    """
+    if auth is not None:
+        thread_data.twitter_api = twitter_api if isinstance(twitter_api, TwitterClient) else tweepy.API(auth)
+    thread_data.worker = True
+
+def init_worker_process():
+    """
+    Worker processes open their own connections to the databases of the cache, since the ones of the parent can not be shared.
+    The connections inherited from the parent are kept, not closed nor used, so nothing of the parent is touched from the worker.
+    The index of the cache is only written by the parent.
+    """
+    global manifest, profile_store, inherited_connections
+    inherited_connections = (manifest, profile_store)
+    manifest = None
+    profile_store = None
+
+def analyze_user_offline(name):
+    """
+    Load a user from the cache and analyze its tweets, friends and followers. Runs in a worker process.
+    The statistics are stored with the user. Returns the name, the summary of the user (None if it is not in the cache or can not be analyzed),
+    its entry for the index of the cache, the measures of the run and the error that stopped the analysis, if any.
+    """
+    run_stats.set_user(name)
+    summary = None
+    entry = None
+    error = None
+    try:
+        if user_in_cache(name):
+            with run_stats.phase('cache_load'):
+                user = load_user(name)
+            # The label is checked in the parent before starting
+            if args.label:
+                user.add_label(args.label)
+            with run_stats.phase('process'):
+                user.process_tweets()
+                user.process_friends()
+                user.process_followers()
+            if user.user_info:
+                with run_stats.phase('analyze_features'):
+                    user.analyze_features()
+            if args.export:
+                with run_stats.phase('export'):
+                    user.export()
+            store_user(user, index=False)
+            entry = Manifest.entry(user)
+            summary = user.summary()
+    except Exception as e:
+        # Printed by the parent, in the order of the names
+        error = '{}: {}'.format(type(e).__name__, e)
+    return name, summary, entry, {category: dict(counter) for category, counter in run_stats.users.pop(name, {}).items()}, error
+
+def report_users_offline(names):
+    """
+    Analyze the users of the cache in args.processes worker processes, and print them in the order of the names
+    """
+    pool = multiprocessing.Pool(args.processes, initializer=init_worker_process)
+    try:
+        for name, summary, entry, measures, error in pool.imap(analyze_user_offline, names):
+            run_stats.merge(name, measures)
+            # Only the parent writes the index, so the workers do not fight for it
+            if entry:
+                get_manifest().write(*entry)
+            if error:
+                print('[\033[91m!\033[0m] Error analyzing {}: {}'.format(name, error))
+                continue
+            if summary is None:
+                print('The user {} is not in our cache database.'.format(name))
+                continue
+            run_stats.set_user(name)
+            user = User.from_summary(name, summary)
+            if args.quickfollowers:
+                user.print_followers()
+            if not args.nosummary:
+                if not user.user_info:
+                    print('The user {} is not in our cache database.'.format(name))
+                    continue
+                with run_stats.phase('print_summary'):
+                    user.print_summary(process=False)
+    finally:
+        pool.close()
+        pool.join()
+
 if __name__ == '__main__':
     try:
 	set_output_encoding()
         # Process Parameters
-        parser = argparse.ArgumentParser(description="Twitter Profiler version %s. Author: Sebastian Garcia (eldraco@gmail.com, @eldracote). Based on original code of @x0rz." % __version__, usage='%(prog)s -n <screen_name> [options]')
-        parser.add_argument('-n', '--names', required=False, metavar="screen_names", help='Target screen_names. Can be a comma separated list of names for multiple comparisons and multiple download of data.')
-        parser.add_argument('-l', '--limit', type=int, default=1000, help='Limit the number of tweets to retreive (default=1000)')
-        parser.add_argument('--no-timezone', action='store_true', help='Removes the timezone auto-adjustment (default is UTC)')
-        parser.add_argument('--utc-offset', type=int, help='Manually apply a timezone offset (in seconds)')
-        parser.add_argument('-s', '--nosummary', action='store_true', default=False, help='Do not show the summary of the user.')
-        parser.add_argument('-F', '--quickfollowers', action='store_true', help='Print only a very short summary about the number of followers for the users. Useful to run with cron and store the results.')
-        parser.add_argument('-c', '--color', action='store_true', help='Do not  Use colors when printing', default=True)
-        parser.add_argument('-N', '--numfriends', action='store', help='Max amount of friends to retrieve. Defaults to 200. Use -1 to retrieve all of them. Warning! this can take long, since twitter limits 700 friends requests every 15mins approx.', default=200, type=int)
-        parser.add_argument('-O', '--numfollowers', action='store', help='Max amount of followers to retrieve. Defaults to 200. Use -1 to retrieve all of them. Warning! this can take long, since twitter limits 700 followers requests every 15mins approx.', default=200, type=int)
-        parser.add_argument('-o', '--offline', action='store_true', default=False, help='Use the offline data stored in cache for all the actions. Do not retrieve them from Twitter (use after you retrieved it at least once).')
-        parser.add_argument('-d', '--debug', action='store', type=int, default=0, help='Debug level.')
-        parser.add_argument('-t', '--maxtweets', action='store', type=int, default=1000, help='Maximum amount of tweets to download for analysis per user.')
-        parser.add_argument('-x', '--redocache', action='store_true', help='Delete all the cache data for this user and download again. Useful if the cache becomes corrupted.')
-        parser.add_argument('-i', '--listcacheusers', action='store_true', help='List the users in the cache.')
-        parser.add_argument('-g', '--graphusers', action='store_true', help='Get the list of users specified with -n, read their _offline_ data, and create a unique graph for all their shared friends. Two files are generated: graph.png and graph.dot. The PNG is an image with basic properties. The dot file is for you to play and improve the graph (e.g. cat graph.dot |sfdp -Tpng -o graph2.png). Use -m to limit the minimum amount of shared connections you want in the graph.')
-        parser.add_argument('-m', '--minnumnsharednodes', action='store', help='Together with -g for making a graph, this options selects the minimum amount of shared friends to put in the graph as nodes. Defaults to 2', default=2, type=int)
-        parser.add_argument('-S', '--sentiment', action='store_true', help='Analyze the sentiment of each twitt', default=False)
-        parser.add_argument('-L', '--label', action='store', required=False, type=str, help='Label to assign to this Twitter user. For humans use human, for bots use bot, for trolls use troll. ', default=False)
-        parser.add_argument('-e', '--export', action='store_true', help='Export the data of this user in his folder called <username>-data.json', default=False)
-        parser.add_argument('-a', '--all', action='store_true', help='Apply the selected actions to all the users in the database.', default=False)
-        args = parser.parse_args()
+        args = parse_arguments()
 
         # The path everyone uses to access the cache
         dirpath = os.path.expanduser('~/.twitter_analyzer_users/')
 
         # If we want to plot users offline, we don't need even to connect to twitter. Do it and exit
         if args.graphusers:
-            plot_users(args.names, dirpath)
+            plot_users(args.names, dirpath, args.graphoutput, args.graphformat, args.render)
+            sys.exit(0)
+
+        # Convert the old cache in one go
+        if args.migratecache:
+            migrate_cache()
             sys.exit(0)
 
         # If we have to list, just list
@@ -1016,107 +2993,111 @@ if __name__ == '__main__':
             list_users_in_db()
             sys.exit(0)
 
-        # Connect to Twitter from now on
-        auth = tweepy.OAuthHandler(consumer_key, consumer_secret)
-        auth.set_access_token(access_token, access_token_secret)
-        twitter_api = tweepy.API(auth)
+        # Export the cache as it is, without connecting to twitter
+        if args.jsonl:
+            export_jsonl([row['screen_name'] for row in get_manifest().users()] if args.all else args.names.split(','), args.jsonl)
+            sys.exit(0)
+
+        # Similarity of the users
+        if args.compare:
+            compare_users([row['screen_name'] for row in get_manifest().users()] if args.all else args.names.split(','), args.compare, args.top, args.matrix)
+            sys.exit(0)
+
+        # Top values of the counters of many users, from the index of the cache
+        if args.query:
+            fields = args.query.split(',')
+            for field in fields:
+                if field not in QUERY_COUNTERS:
+                    print('Unknown counter {}. The counters are: {}'.format(field, ', '.join(QUERY_COUNTERS)))
+                    sys.exit(-1)
+            query_counters(None if args.all or not args.names else args.names.split(','), fields, args.querylabel, args.top)
+            sys.exit(0)
+
+        # Changes of the friends and followers between snapshots
+        if args.churn:
+            print_churn([row['screen_name'] for row in get_manifest().users()] if args.all else args.names.split(','), args.churn)
+            sys.exit(0)
+
+        # Growth of the monitored users, from their time series
+        if args.growth is not None:
+            if args.watchlist:
+                names = read_watchlist(args.watchlist)
+            elif args.all:
+                names = sorted(name[:-len('.ts')] for name in listdir(dirpath + TIMESERIES_DIR) if name.endswith('.ts')) if isdir(dirpath + TIMESERIES_DIR) else []
+            else:
+                names = args.names.split(',')
+            print_growth(names, args.growth)
+            sys.exit(0)
+
+        # The amount of followers in the cache is in its index
+        if args.quickfollowers and args.offline:
+            print_followers_from_manifest(None if args.all else args.names.split(','))
+            sys.exit(0)
+
+        # Connect to Twitter from now on. Offline we only read the cache
+        auth = None
+        if not args.offline:
+            from secrets import consumer_key, consumer_secret, access_token, access_token_secret
+            auth = tweepy.OAuthHandler(consumer_key, consumer_secret)
+            auth.set_access_token(access_token, access_token_secret)
+            if args.connections > 1 or args.apiurl != API_URL:
+                # Each worker thread can use all its connections at the same time
+                twitter_api = TwitterClient(auth, args.apiurl, args.connections * args.workers)
+            else:
+                twitter_api = tweepy.API(auth)
+
+        # Only refresh the counts of the users
+        if args.monitor:
+            if args.offline:
+                print('The users can not be monitored offline.')
+                sys.exit(-1)
+            if args.watchlist:
+                names = read_watchlist(args.watchlist)
+            elif args.all:
+                names = [row['screen_name'] for row in get_manifest().users()]
+            else:
+                names = args.names.split(',')
+            monitor_users(names, auth)
+            sys.exit(0)
 
         # Do we have names to process, or all the database?
         if args.all:
-            names = [f for f in listdir(dirpath) if isdir(join(dirpath, f))]
+            names = [row['screen_name'] for row in get_manifest().users()]
         elif not args.all:
             names = args.names.split(',')
 
+        # Build the index of the cache here if it is needed, and not in the first worker that stores a user
+        get_manifest()
+
         # Go user by user given
-        if names:
-            for name in names:
-                print('\nProcessing the name {}.'.format(name))
-                try:
+        if names and args.offline and args.processes > 1 and not args.sentiment:
+            # Check the label before starting the workers
+            if args.label and User('label').add_label(args.label) == False:
+                sys.exit(-1)
+            report_users_offline(names)
+        elif names:
+            pool = None
+            if args.workers > 1:
+                # Download several users at the same time sharing the rate limits. The results are reported in the order given
+                pool = ThreadPool(args.workers, initializer=init_worker_api, initargs=(auth,))
+                fetched_users = pool.imap(fetch_user, names)
+            else:
+                fetched_users = (fetch_user(name) for name in names)
+            try:
+                for user, exists in fetched_users:
+                    report_user(user, exists)
+            finally:
+                if pool:
+                    pool.close()
+                    pool.join()
 
-                    # Should we delete the cache for this user?
-                    if args.redocache:
-                        print 'Deleteing all the cache from this user and starting again.'
-                        shutil.rmtree(dirpath + name, ignore_errors=True)
-
-                    # Create our folder if we need it, and the user object
-                    try:
-                        os.makedirs(dirpath + name)
-                        # It does not exist yet
-                        if args.debug > 1:
-                            print('Folders created in {}'.format(dirpath + name))
-                        user = User(name)
-                    except OSError:
-                        # Already exists
-                        exists = True
-                        if args.debug > 1:
-                            print('The user {} exists, loading its data.'.format(name))
-                        # Load what we know from this user
-                        # We always load the cache, if we are offline or not.
-                        try:
-                            datapath = os.path.expanduser(dirpath + name + '/' + name + '.data')
-                            # This takes time
-                            user = pickle.load(open(datapath, 'rb'))
-                        except IOError:
-                            user = User(name)
-                    user.dirpath = dirpath
-
-
-                    # If offline, load the file only, if online, get more data
-                    # Get basic info from twitter if we are not offline. If offline, get the cache
-                    if not args.offline:
-                        if args.debug > 1:
-                            print('Getting basic twitter info.')
-                        #
-                        # Here is where most of the stuff happens, donwloading data from twitter api
-                        # Get basic info
-                        exists = user.get_twitter_info()
-                        if exists and not user.protected:
-                            # Get friends
-                            user.get_friends()
-                            # Get followers
-                            user.get_followers()
-                            # Get twitts
-                            user.get_tweets()
-
-                    ############################
-                    # After downloading the data (or not if offline) do things with it
-                    if exists:
-                        # Add the label
-                        if args.label:
-                            # Adding the label can fail because of the format
-                            if user.add_label(args.label) == False:
-                                sys.exit(-1)
-                        # Only show the amount of friends
-                        if args.quickfollowers:
-                            user.print_followers()
-                        if args.sentiment:
-                            user.analyze_sentiments()
-                        # Analyze features of the profile
-                        user.analyze_features()
-                        # Option by default, print a Summary of the account, including the friends
-                        if not args.nosummary:
-                            # To protect from offline asking of unknown users
-                            if args.offline and not user.user_info:
-                                print('The user {} is not in our cache database.'.format(user.screen_name))
-                                sys.exit(0)
-                            user.print_summary()
-                        # Export the data to disk
-                        if args.export:
-                            user.export()
-                        # Always Store this user in our disk cache
-                        pickle.dump(user, open( dirpath + name + '/' + name + '.data', "wb" ) )
-                except KeyboardInterrupt:
-                    # Print Summary of detections in the last Time Window
-                    print('Keyboard Interrupt. Storing the user')
-                    pickle.dump(user, open( dirpath + name + '/' + name + '.data', "wb" ) )
+        if args.stats:
+            run_stats.print_report(args.stats)
 
-    except tweepy.error.TweepError as e:
+    except Exception as e:
+        # The errors of each user are handled in fetch_user(). The rest of twitter errors end here
+        # Only look for them if tweepy was used, so the offline commands do not import it just to check
+        if 'tweepy' not in sys.modules or not isinstance(e, tweepy.error.TweepError):
+            raise
         print("[\033[91m!\033[0m] Twitter error: {}".format(e))
-        try:
-            if e[0][0]['code'] == 50:
-                # user not found
-                shutil.rmtree(dirpath + name, ignore_errors=True)
-        except TypeError:
-            if e == 'Not authorized':
-                print('The account of this user is protected, we can not get its friends.')
-            sys.exit(0)
+        sys.exit(0)